@@ -2,30 +2,124 @@
 - SBD: 10 hàng x 6 cột
 - Mã đề: 10 hàng x 3 cột
 '''
-import cv2, os, shutil, numpy as np
+import cv2, os, queue, threading, numpy as np
+from contextlib import contextmanager
 from pathlib import Path
-from ultralytics import YOLO
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 REGION_MODEL = BASE_DIR / "AI/best/regions/best.pt"
 BUBBLE_MODEL = BASE_DIR / "AI/best/bubbles/best.pt"
 
+# Backend inference: torch (best.pt), onnx (ONNX Runtime) hoặc openvino, có thể dùng model INT8
+AI_BACKENDS = ("torch", "onnx", "openvino")
+AI_BACKEND = os.environ.get("AI_BACKEND", "torch").lower()
+AI_INT8 = os.environ.get("AI_INT8", "False").lower() in ("1", "true", "yes")
+
 REGION_CLASSES = {0: "Answer_region", 1: "MaDe_region", 2: "SBD_region"}
 BUBBLE_CLASSES = {0: "Filled", 1: "Unfilled"}
+FILLED_CLASS = 0
 
 REGION_COLOR = {"Answer_region": (255, 0, 0), "MaDe_region": (255, 255, 0), "SBD_region": (128, 0, 128)}
 BUBBLE_COLOR = {"Filled": (0, 255, 0), "Unfilled": (0, 0, 255)}
 
-OUT_DIR   = str(BASE_DIR / "AI/out")
 MAX_COLS_ANSWER = 4
+ORIENTATION_SIZE = 640 # Cạnh dài của ảnh thu nhỏ dùng để xác định góc xoay
 
-region_model = YOLO(REGION_MODEL)
-bubble_model = YOLO(BUBBLE_MODEL)
+def get_model_path(pt_path, backend=AI_BACKEND, int8=AI_INT8):
+    """
+    Đường dẫn model đã export tương ứng với `backend`, nằm cùng thư mục với `pt_path`
+    (theo cách đặt tên của `YOLO.export` và `AI/export.py`).
+    """
+    pt_path = Path(pt_path)
+    suffix = "_int8" if int8 else ""
+    if backend == "torch":
+        return pt_path
+    if backend == "onnx":
+        return pt_path.with_name(f"{pt_path.stem}{suffix}.onnx")
+    if backend == "openvino":
+        return pt_path.with_name(f"{pt_path.stem}{suffix}_openvino_model")
+    raise ValueError(f"AI_BACKEND không hợp lệ: {backend} (chọn một trong {', '.join(AI_BACKENDS)})")
+
+def load_model(pt_path, backend=AI_BACKEND, int8=AI_INT8):
+    # Import ultralytics (và torch) khi cần để process không inference không phải tải
+    from ultralytics import YOLO
+
+    path = get_model_path(pt_path, backend, int8)
+    if backend == "torch":
+        return YOLO(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Không tìm thấy model {backend}: {path} (chạy `python -m AI.export --format {backend}` trước)")
+    return YOLO(str(path), task="detect")
+
+# Model chỉ được tải ở lần dùng đầu tiên (hoặc khi gọi `warm_up`)
+# Predictor của ultralytics không thread-safe (mỗi lần gọi ghi đè predictor.args), nên mỗi luồng
+# inference mượn 1 bộ model riêng (slot). Tối đa AI_MAX_CONCURRENCY luồng inference cùng lúc trong 1 process,
+# các luồng khác chờ tới lượt; slot dùng gần nhất được mượn trước nên chỉ tải thêm bộ model khi thật sự cần.
+AI_MAX_CONCURRENCY = max(int(os.environ.get("AI_MAX_CONCURRENCY", "2")), 1)
+_models = {}
+_models_lock = threading.Lock()
+_slots = queue.LifoQueue()
+for _slot in reversed(range(AI_MAX_CONCURRENCY)):
+    _slots.put(_slot)
+_local = threading.local()
+
+@contextmanager
+def model_slot():
+    # Mượn 1 bộ model cho luồng hiện tại (gọi lồng nhau thì dùng lại slot đang giữ)
+    if getattr(_local, "slot", None) is not None:
+        yield _local.slot
+        return
+    slot = _slots.get()
+    _local.slot = slot
+    try:
+        yield slot
+    finally:
+        _local.slot = None
+        _slots.put(slot)
+
+def get_model(pt_path):
+    # Model của slot mà luồng hiện tại đang giữ (xem `model_slot`)
+    slot = getattr(_local, "slot", None)
+    if slot is None:
+        raise RuntimeError("get_model phải được gọi bên trong model_slot()")
+    model = _models.get((slot, pt_path))
+    if model is None:
+        with _models_lock:
+            model = _models.get((slot, pt_path))
+            if model is None:
+                model = load_model(pt_path)
+                _models[(slot, pt_path)] = model
+    return model
+
+def get_region_model():
+    return get_model(REGION_MODEL)
+
+def get_bubble_model():
+    return get_model(BUBBLE_MODEL)
+
+def warm_up():
+    # Tải trước cả 2 model và chạy thử 1 lần để lần xử lý đầu tiên không bị chậm
+    blank = np.zeros((ORIENTATION_SIZE, ORIENTATION_SIZE, 3), dtype=np.uint8)
+    with model_slot():
+        get_region_model()(blank, verbose=False)
+        get_bubble_model()(blank, verbose=False)
+
+def decode_image(image):
+    # Nhận ảnh dạng ndarray, bytes hoặc đường dẫn
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (str, Path)):
+        return cv2.imread(str(image))
+    buf = np.frombuffer(image, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
 
-def clear_output_dir(path="out"):
-    if os.path.exists(path):
-        shutil.rmtree(path, ignore_errors=True)
-    os.makedirs(path, exist_ok=True)
+def encode_image(img, ext=".jpg"):
+    ok, buf = cv2.imencode(ext, img)
+    if not ok:
+        raise ValueError("Không thể mã hoá ảnh")
+    return buf.tobytes()
 
 def rotate_by_90(img, k):
     k = k % 4
@@ -38,236 +132,167 @@ def rotate_by_90(img, k):
     else:
         return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
     
-def detect_bubbles(img, conf=0.5):
-    res = bubble_model(img, conf=conf, verbose=False)[0]
+def parse_detections(res):
+    # Chuyển kết quả YOLO sang mảng NumPy: boxes (N x 4), classes (N), confs (N)
+    return {
+        "boxes": res.boxes.xyxy.cpu().numpy().astype(int).reshape(-1, 4),
+        "classes": res.boxes.cls.cpu().numpy().astype(int),
+        "confs": res.boxes.conf.cpu().numpy().astype(float),
+    }
+
+def detections_to_bubbles(det):
     arr = []
-    for box, cls in zip(res.boxes.xyxy, res.boxes.cls):
-        x1, y1, x2, y2 = map(int, box.tolist())
+    for (x1, y1, x2, y2), cls, conf in zip(det["boxes"].tolist(), det["classes"].tolist(), det["confs"].tolist()):
         arr.append({
             "box": (x1, y1, x2, y2),
             "center": ((x1 + x2) // 2, (y1 + y2) // 2),
-            "class": BUBBLE_CLASSES.get(int(cls))
+            "class": BUBBLE_CLASSES.get(cls),
+            "conf": conf
         })
     return arr
 
-def filter_normal_bubbles(bubbles, scale_low=0.5, scale_high=1.5):
-    # Dùng để loại ô đen to khác thường
-    if not bubbles:
-        return []
-    areas = [(b["box"][2] - b["box"][0]) * (b["box"][3] - b["box"][1]) for b in bubbles]
-    med = np.median(areas)
-    good = []
-    for b in bubbles:
-        area = (b["box"][2] - b["box"][0]) * (b["box"][3] - b["box"][1])
-        if med * scale_low <= area <= med * scale_high:
-            good.append(b)
-            
-    return good
-
-def get_bubble_rect(bubble):
-    x1 = bubble["box"][0]
-    y1 = bubble["box"][1]
-    x2 = bubble["box"][2]
-    y2 = bubble["box"][3]
-    return x1, y1, x2, y2
-
-def read_sbd(crop):
+def detect_bubbles(img, conf=0.5):
+    res = get_bubble_model()(img, conf=conf, verbose=False)[0]
+    return detections_to_bubbles(parse_detections(res))
+
+def detect_bubbles_batch(crops, conf=0.35):
     """
-    Đọc vùng SBD dạng lưới 10x6 từ ảnh `crop`.
-    Trả về chuỗi các số tìm được, hoặc None nếu không hợp lệ.
+    Detect bubble cho tất cả các vùng của một tờ bài trong 1 lần gọi `bubble_model`.
+    Trả về danh sách detection (dạng mảng NumPy) tương ứng với từng ảnh trong `crops`.
     """
-    # Detect bubble lần 1
-    bubbles = detect_bubbles(crop, conf=0.5)
+    if not crops:
+        return []
+    results = get_bubble_model()(list(crops), conf=conf, verbose=False)
+    return [parse_detections(res) for res in results]
 
-    # Nếu detect ít hơn 5 bubble thì nới conf ra
-    if len(bubbles) < 5:
-        bubbles = detect_bubbles(crop, conf=0.35)
+def mask_detections(det, mask):
+    return {key: value[mask] for key, value in det.items()}
 
-    # Không detect được gì
-    if not bubbles:
-        return None
+def select_detections(det, conf=0.5, min_count=5):
+    # Tương đương detect lần 1 với conf 0.5, nếu ít hơn 5 bubble thì nới conf ra (0.35)
+    # NMS xét box theo conf giảm dần nên các box >= 0.5 không bị ảnh hưởng bởi box conf thấp hơn
+    mask = det["confs"] >= conf
+    if mask.sum() < min_count:
+        return det
+    return mask_detections(det, mask)
 
-    # Lọc bubble [bình thường]
-    bubbles = filter_normal_bubbles(bubbles)
-    if not bubbles:
-        return None
+def box_areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
 
-    # vẽ bounding box
-    min_x, min_y, max_x, max_y = get_bubble_rect(bubbles[0])
-    for b in bubbles:
-        x1, y1, x2, y2 = get_bubble_rect(b)
-        min_x = min(min_x, x1)
-        min_y = min(min_y, y1)
-        max_x = max(max_x, x2)
-        max_y = max(max_y, y2)        
-        cv2.rectangle(crop, (x1, y1), (x2, y2), BUBBLE_COLOR.get(b["class"]), 1)
-    box_w = max_x - min_x
-    box_h = max_y - min_y
-    box_w = box_w // 6
-    box_h = box_h // 10
-
-    areas = [(b["box"][2] - b["box"][0]) * (b["box"][3] - b["box"][1]) for b in bubbles]
+def filter_normal_bubbles(det, scale_low=0.5, scale_high=1.5):
+    # Dùng để loại ô đen to khác thường
+    if not len(det["boxes"]):
+        return det
+    areas = box_areas(det["boxes"])
     med = np.median(areas)
-    if not(med * 0.2 < box_w * box_h):
-        # print(med, box_w * box_h)
-        return None
+    return mask_detections(det, (med * scale_low <= areas) & (areas <= med * scale_high))
 
-    mat = [[False for j in range(6)] for i in range(10)]
-    for b in bubbles:
-        if b["class"] == BUBBLE_CLASSES.get(0):
-            xc, yc = b["center"]
-            j = (xc - min_x) // box_w
-            i = (yc - min_y) // box_h
-            mat[i][j] = True
-
-    result = ["?"] * 6
-    for i in range(10):
-        for j in range(6):
-            if mat[i][j]:
-                result[j] = str(i)
-            #     cv2.rectangle(crop, (min_x + j * box_w, min_y + i * box_h), (min_x + (j + 1) * box_w, min_y + (i + 1) * box_h), (0, 127, 255), 2)
-            # else: 
-            #     cv2.rectangle(crop, (min_x + j * box_w, min_y + i * box_h), (min_x + (j + 1) * box_w, min_y + (i + 1) * box_h), (127, 127, 0), 1)
-    # cv2.imwrite(os.path.join(angle_dir, "SBD.jpg"), crop)
-    return "".join(result), bubbles
-
-def read_made(crop):
+def decode_grid(boxes, classes, rows, cols, axis=0):
     """
-    Đọc vùng MaDe dạng lưới 10x3 từ ảnh `crop`.
-    Trả về chuỗi các số tìm được, hoặc None nếu không hợp lệ.
+    Giải mã lưới `rows` x `cols` từ các bubble (`boxes` N x 4, `classes` N) bằng NumPy.
+    axis=0: mỗi cột chọn 1 hàng (SBD, Mã đề); axis=1: mỗi hàng chọn 1 cột (đáp án).
+    Trả về dict gồm ma trận ô được tô `cells`, lựa chọn `values` (-1 nếu bỏ trống, ô cuối cùng nếu tô nhiều ô)
+    và số ô được tô `counts`, hoặc None nếu lưới không hợp lệ.
     """
-    # Detect bubble lần 1
-    bubbles = detect_bubbles(crop, conf=0.5)
-
-    # Nếu detect ít hơn 5 bubble thì nới conf ra
-    if len(bubbles) < 5:
-        bubbles = detect_bubbles(crop, conf=0.35)
-
-    # Không detect được gì
-    if not bubbles:
+    if not len(boxes):
         return None
+    min_x, min_y = boxes[:, 0].min(), boxes[:, 1].min()
+    max_x, max_y = boxes[:, 2].max(), boxes[:, 3].max()
+    box_w = (max_x - min_x) // cols
+    box_h = (max_y - min_y) // rows
 
-    # Lọc bubble [bình thường]
-    bubbles = filter_normal_bubbles(bubbles)
-    if not bubbles:
+    if not(np.median(box_areas(boxes)) * 0.2 < box_w * box_h):
         return None
 
-    # vẽ bounding box
-    min_x, min_y, max_x, max_y = get_bubble_rect(bubbles[0])
-    for b in bubbles:
-        x1, y1, x2, y2 = get_bubble_rect(b)
-        min_x = min(min_x, x1)
-        min_y = min(min_y, y1)
-        max_x = max(max_x, x2)
-        max_y = max(max_y, y2)        
-        cv2.rectangle(crop, (x1, y1), (x2, y2), BUBBLE_COLOR.get(b["class"]), 1)
-    box_w = max_x - min_x
-    box_h = max_y - min_y
-    box_w = box_w // 3
-    box_h = box_h // 10
-
-    areas = [(b["box"][2] - b["box"][0]) * (b["box"][3] - b["box"][1]) for b in bubbles]
-    med = np.median(areas)
-    if not(med * 0.2 < box_w * box_h):
-        return None
+    filled = boxes[classes == FILLED_CLASS]
+    xc = (filled[:, 0] + filled[:, 2]) // 2
+    yc = (filled[:, 1] + filled[:, 3]) // 2
+    j = np.clip((xc - min_x) // box_w, 0, cols - 1)
+    i = np.clip((yc - min_y) // box_h, 0, rows - 1)
+
+    cells = np.zeros((rows, cols), dtype=bool)
+    cells[i, j] = True
+
+    counts = cells.sum(axis=axis)
+    last = cells.shape[axis] - 1 - np.argmax(np.flip(cells, axis=axis), axis=axis)
+    values = np.where(counts > 0, last, -1)
+    return {"cells": cells, "values": values, "counts": counts}
+
+def grid_report(grid):
+    # Vị trí (bắt đầu từ 1) bị tô nhiều ô hoặc bỏ trống
+    return {
+        "multi_marked": (np.flatnonzero(grid["counts"] > 1) + 1).tolist(),
+        "blank": (np.flatnonzero(grid["counts"] == 0) + 1).tolist(),
+    }
+
+def read_digits(det, rows, cols):
+    det = filter_normal_bubbles(select_detections(det))
+    grid = decode_grid(det["boxes"], det["classes"], rows, cols, axis=0)
+    if grid is None:
+        return None, det, None
+    result = "".join(str(v) if v >= 0 else "?" for v in grid["values"].tolist())
+    return result, det, grid_report(grid)
+
+def read_sbd(crop, det=None):
+    """
+    Đọc vùng SBD dạng lưới 10x6 từ ảnh `crop` (hoặc detection `det` đã có).
+    Trả về (chuỗi các số tìm được hoặc None nếu không hợp lệ, các bubble đã dùng, báo cáo ô tô nhiều/bỏ trống).
+    """
+    if det is None:
+        det = detect_bubbles_batch([crop])[0]
+    return read_digits(det, 10, 6)
 
-    mat = [[False for j in range(3)] for i in range(10)]
-    for b in bubbles:
-        if b["class"] == BUBBLE_CLASSES.get(0):
-            xc, yc = b["center"]
-            j = (xc - min_x) // box_w
-            i = (yc - min_y) // box_h
-            mat[i][j] = True
-
-    result = ["?"] * 3
-    for i in range(10):
-        for j in range(3):
-            if mat[i][j]:
-                result[j] = str(i)
-            #     cv2.rectangle(crop, (min_x + j * box_w, min_y + i * box_h), (min_x + (j + 1) * box_w, min_y + (i + 1) * box_h), (0, 127, 255), 2)
-            # else: 
-            #     cv2.rectangle(crop, (min_x + j * box_w, min_y + i * box_h), (min_x + (j + 1) * box_w, min_y + (i + 1) * box_h), (127, 127, 0), 1)
-    # cv2.imwrite(os.path.join(angle_dir, "MADE.jpg"), crop)
-    return "".join(result), bubbles
-
-def read_answer(answers_region):
-    n_section = 1
-    groups = {}
-    group_i = 0
-    for region in answers_region:
-        crop = region["crop"].copy()
-        # Detect bubble lần 1
-        bubbles = detect_bubbles(crop, conf=0.5)
-
-        # Nếu detect ít hơn 5 bubble thì nới conf ra
-        if len(bubbles) < 5:
-            bubbles = detect_bubbles(crop, conf=0.35)
+def read_made(crop, det=None):
+    """
+    Đọc vùng MaDe dạng lưới 10x3 từ ảnh `crop` (hoặc detection `det` đã có).
+    Trả về (chuỗi các số tìm được hoặc None nếu không hợp lệ, các bubble đã dùng, báo cáo ô tô nhiều/bỏ trống).
+    """
+    if det is None:
+        det = detect_bubbles_batch([crop])[0]
+    return read_digits(det, 10, 3)
 
+def read_answer(answers_region, answers_det=None):
+    """
+    Đọc các vùng đáp án, mỗi nhóm cột gồm 10 câu x 4 lựa chọn.
+    Trả về (danh sách đáp án hoặc None nếu không hợp lệ, bubble đã dùng của từng vùng, báo cáo ô tô nhiều/bỏ trống).
+    """
+    if answers_det is None:
+        answers_det = detect_bubbles_batch([region["crop"] for region in answers_region])
+
+    sections = []
+    groups = []
+    for det in answers_det:
+        det = filter_normal_bubbles(select_detections(det))
+        sections.append(det)
         # Không detect được gì
-        if not bubbles:
-            return None
-
-        # Lọc bubble [bình thường]
-        bubbles = filter_normal_bubbles(bubbles)
-        if not bubbles:
-            return None
-
-        # vẽ bounding box
-        for b in bubbles:
-            x1, y1, x2, y2 = get_bubble_rect(b)
-            cv2.rectangle(crop, (x1, y1), (x2, y2), BUBBLE_COLOR.get(b["class"]), 1)
-
-        widths = [(b["box"][2] - b["box"][0]) for b in bubbles]
-        med_w = np.median(widths)
-
-        bubbles = sorted(bubbles, key=lambda e: e["box"][0])
-
-        curr_b = bubbles[0]
-        for b in bubbles:
-            if abs(curr_b["box"][0] - b["box"][0]) > med_w * 2:
-                group_i += 1
-            groups.setdefault(group_i, {"bubbles": [], "section": n_section})["bubbles"].append(b)
-            curr_b = b
-        
-        # cv2.imwrite(os.path.join(angle_dir, f"DAPAN_{n_section}.jpg"), crop)
-        n_section += 1
-        group_i += 1
-    # print("Number of group: ", len(groups))
+        if not len(det["boxes"]):
+            return None, sections, None
+
+        # Tách nhóm cột: 2 bubble liền kề (theo x) cách nhau quá 2 lần độ rộng trung vị
+        order = np.argsort(det["boxes"][:, 0], kind="stable")
+        boxes, classes = det["boxes"][order], det["classes"][order]
+        med_w = np.median(boxes[:, 2] - boxes[:, 0])
+        group_ids = np.concatenate(([0], np.cumsum(np.abs(np.diff(boxes[:, 0])) > med_w * 2)))
+        for g in range(group_ids[-1] + 1):
+            mask = group_ids == g
+            groups.append((boxes[mask], classes[mask]))
+
     result = ["?"] * len(groups) * 10 # Mỗi group có 10 câu
-    for b_i, group in groups.items():
-        bubbles = group["bubbles"]
-        min_x, min_y, max_x, max_y = get_bubble_rect(bubbles[0])
-        for b in bubbles:
-            x1, y1, x2, y2 = get_bubble_rect(b)
-            min_x = min(min_x, x1)
-            min_y = min(min_y, y1)
-            max_x = max(max_x, x2)
-            max_y = max(max_y, y2)    
-
-        box_w = max_x - min_x
-        box_h = max_y - min_y
-        box_w = box_w // 4
-        box_h = box_h // 10
-
-        areas = [(b["box"][2] - b["box"][0]) * (b["box"][3] - b["box"][1]) for b in bubbles]
-        med = np.median(areas)
-        if not(med * 0.2 < box_w * box_h):
-            return None
-
-        mat = [[False for j in range(4)] for i in range(10)]
-        for b in bubbles:
-            if b["class"] == BUBBLE_CLASSES.get(0):
-                xc, yc = b["center"]
-                j = (xc - min_x) // box_w
-                i = (yc - min_y) // box_h
-                mat[i][j] = True
-
-        for i in range(10):
-            for j in range(4):
-                if mat[i][j]:
-                    result[b_i * 10 + i] = str(j)
-
-    return result, groups
+    counts = np.zeros(len(groups) * 10, dtype=int)
+    for b_i, (boxes, classes) in enumerate(groups):
+        grid = decode_grid(boxes, classes, 10, MAX_COLS_ANSWER, axis=1)
+        if grid is None:
+            return None, sections, None
+        counts[b_i * 10:(b_i + 1) * 10] = grid["counts"]
+        for i in np.flatnonzero(grid["values"] >= 0).tolist():
+            result[b_i * 10 + i] = str(grid["values"][i])
+
+    return result, sections, grid_report({"counts": counts})
+
+def draw_bubbles(img, det, offset):
+    ox, oy = offset[0], offset[1]
+    for (x1, y1, x2, y2), cls in zip(det["boxes"].tolist(), det["classes"].tolist()):
+        cv2.rectangle(img, (x1 + ox, y1 + oy), (x2 + ox, y2 + oy), BUBBLE_COLOR.get(BUBBLE_CLASSES.get(cls)), 1)
 
 def is_region_correct(sbd_region, made_region, answer_region):
     if len(sbd_region) != 1:
@@ -296,76 +321,118 @@ def is_region_correct(sbd_region, made_region, answer_region):
     
     return True
 
+def get_regions(det, scale_x=1.0, scale_y=1.0):
+    regions = {}
+    for box, cls in zip(det.boxes.xyxy, det.boxes.cls):
+        x1, y1, x2, y2 = box.tolist()
+        box = (int(x1 * scale_x), int(y1 * scale_y), int(x2 * scale_x), int(y2 * scale_y))
+        name = REGION_CLASSES.get(int(cls))
+        regions.setdefault(name, []).append({"box": box})
+    return regions
+
+def crop_regions(img, regions):
+    for items in regions.values():
+        for region in items:
+            x1, y1, x2, y2 = region["box"]
+            region["crop"] = img[y1:y2, x1:x2]
+    return regions
+
+def detect_orientation(img0):
+    """
+    Xác định góc xoay của ảnh `img0` bằng 1 lần inference `region_model` trên batch 4 góc xoay
+    của ảnh thu nhỏ, chọn góc đầu tiên thoả `is_region_correct`.
+    Trả về (k, ảnh đã xoay, các vùng đã crop), hoặc (None, None, None) nếu không góc nào hợp lệ.
+    """
+    h, w = img0.shape[:2]
+    scale = min(1.0, ORIENTATION_SIZE / max(h, w))
+    small = img0
+    if scale < 1.0:
+        small = cv2.resize(img0, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    rotations = [rotate_by_90(small, k) for k in range(4)]
+    dets = get_region_model()(rotations, verbose=False)
+    for k, det in enumerate(dets):
+        regions = get_regions(det)
+        if not is_region_correct(regions.get("SBD_region", []), regions.get("MaDe_region", []), regions.get("Answer_region", [])):
+            continue
+
+        # Chỉ xoay ảnh gốc với góc đã chọn, đổi toạ độ vùng về kích thước ảnh gốc
+        img_rot = rotate_by_90(img0, k)
+        scale_x = img_rot.shape[1] / rotations[k].shape[1]
+        scale_y = img_rot.shape[0] / rotations[k].shape[0]
+        regions = crop_regions(img_rot, get_regions(det, scale_x, scale_y))
+        return k, img_rot, regions
+
+    return None, None, None
+
 class No_Le_AI:
     def __init__(self):
         pass
 
-    def process(self, image_path):
-        clear_output_dir(OUT_DIR)
-
-        img0 = cv2.imread(image_path)
+    def process(self, image, progress=None):
+        """
+        Xử lý ảnh tờ bài `image` (bytes, ndarray hoặc đường dẫn) hoàn toàn trong bộ nhớ.
+        `progress(stage)` (nếu có) được gọi khi bắt đầu mỗi bước: orientation, bubbles, render.
+        Trả về (result_json, ảnh đã vẽ bounding box dạng JPEG bytes), hoặc (None, None) nếu không đọc được tờ bài.
+        """
+        img0 = decode_image(image)
         if img0 is None:
-            raise FileNotFoundError(f"Không tìm thấy ảnh: {image_path}")
-        
-        for k in range(4):
-            angle = (k * 90) % 360
-            # print("angle: ", angle)
-            img_rot = rotate_by_90(img0, k)
-            img_out = img_rot.copy()
-            cv2.imwrite(os.path.join(OUT_DIR, "before.jpg"), img_rot)
-
-            det = region_model(img_rot, verbose=False)[0]
-            regions = {}
-            for box, cls in zip(det.boxes.xyxy, det.boxes.cls):
-                x1, y1, x2, y2 = map(int, box.tolist())
-                name = REGION_CLASSES.get(int(cls))
-                crop = img_rot[y1:y2, x1:x2]
-                regions.setdefault(name, []).append({"crop": crop, "box": (x1, y1, x2, y2)})
-            
-            sbd_region  = regions.get("SBD_region", [])
-            made_region = regions.get("MaDe_region", [])
-            answers_region = regions.get("Answer_region", [])
-
-            if not is_region_correct(sbd_region, made_region, answers_region):
-                continue
-            
-            sbd, sbd_bubbles  = read_sbd(sbd_region[0]["crop"].copy())
-            # if sbd:
-            #     print("Số báo danh: ", sbd)
-
-            made, made_bubbles  = read_made(made_region[0]["crop"].copy())
-            # if made:
-            #     print("Mã đề: ", made)
-
-            answers_region = sorted(answers_region, key=lambda e: e["box"][1])
-            answers, answers_groups = read_answer(answers_region)
-            answers_dict = {}
-            if answers:
-                answers_dict = {
-                    str(i + 1): ("?" if ans == "?" else chr(ord("A") + int(ans)))
-                    for i, ans in enumerate(answers)
-                }
-            else:
-                answers_dict = None
-            result_json = {
-                "sbd": sbd,
-                "made": made,
-                "answers": answers_dict,
+            raise ValueError("Không đọc được ảnh")
+        with model_slot():
+            return self.process_image(img0, progress)
+
+    def process_image(self, img0, progress=None):
+        report = progress or (lambda stage: None)
+
+        # Xác định góc xoay 1 lần, phần còn lại chỉ chạy trên 1 ảnh
+        report("orientation")
+        k, img_rot, regions = detect_orientation(img0)
+        if img_rot is None:
+            return None, None
+        img_out = img_rot.copy()
+
+        sbd_region  = regions.get("SBD_region", [])
+        made_region = regions.get("MaDe_region", [])
+        answers_region = regions.get("Answer_region", [])
+
+        answers_region = sorted(answers_region, key=lambda e: e["box"][1])
+
+        # Detect bubble của SBD, Mã đề và tất cả vùng đáp án trong 1 lần inference
+        report("bubbles")
+        crops = [sbd_region[0]["crop"], made_region[0]["crop"]] + [region["crop"] for region in answers_region]
+        detections = detect_bubbles_batch(crops)
+
+        sbd, sbd_bubbles, sbd_report = read_sbd(sbd_region[0]["crop"], detections[0])
+        # if sbd:
+        #     print("Số báo danh: ", sbd)
+
+        made, made_bubbles, made_report = read_made(made_region[0]["crop"], detections[1])
+        # if made:
+        #     print("Mã đề: ", made)
+
+        answers, answers_sections, answers_report = read_answer(answers_region, detections[2:])
+        answers_dict = {}
+        if answers:
+            answers_dict = {
+                str(i + 1): ("?" if ans == "?" else chr(ord("A") + int(ans)))
+                for i, ans in enumerate(answers)
             }
-            # Vẽ bounding box
-            for b in sbd_bubbles:
-                x1, y1, x2, y2 = get_bubble_rect(b)
-                cv2.rectangle(img_out, (x1 + sbd_region[0]["box"][0], y1 + sbd_region[0]["box"][1]), 
-                                     (x2 + sbd_region[0]["box"][0], y2 + sbd_region[0]["box"][1]), BUBBLE_COLOR.get(b["class"]), 1)
-            for b in made_bubbles:
-                x1, y1, x2, y2 = get_bubble_rect(b)
-                cv2.rectangle(img_out, (x1 + made_region[0]["box"][0], y1 + made_region[0]["box"][1]), 
-                                     (x2 + made_region[0]["box"][0], y2 + made_region[0]["box"][1]), BUBBLE_COLOR.get(b["class"]), 1)
-            for group in answers_groups.values():
-                region = answers_region[group["section"] -1]
-                for b in group["bubbles"]:
-                    x1, y1, x2, y2 = get_bubble_rect(b)
-                    cv2.rectangle(img_out, (x1 + region["box"][0], y1 + region["box"][1]), 
-                                         (x2 + region["box"][0], y2 + region["box"][1]), BUBBLE_COLOR.get(b["class"]), 1)
-            cv2.imwrite(os.path.join(OUT_DIR, "after.jpg"), img_out)
-            return result_json
\ No newline at end of file
+        else:
+            answers_dict = None
+        result_json = {
+            "sbd": sbd,
+            "made": made,
+            "answers": answers_dict,
+            "report": {
+                "sbd": sbd_report,
+                "made": made_report,
+                "answers": answers_report,
+            },
+        }
+        # Vẽ bounding box
+        report("render")
+        draw_bubbles(img_out, sbd_bubbles, sbd_region[0]["box"])
+        draw_bubbles(img_out, made_bubbles, made_region[0]["box"])
+        for region, det in zip(answers_region, answers_sections):
+            draw_bubbles(img_out, det, region["box"])
+        return result_json, encode_image(img_out)
@@ -0,0 +1,114 @@
+'''
+Export model YOLO sang ONNX / OpenVINO (có thể lượng tử hoá INT8) và kiểm tra
+kết quả của backend đã export so với backend torch.
+
+    cd server
+    python -m AI.export --format onnx [--int8]
+    python -m AI.export --format openvino [--int8 --data calib.yaml]
+    python -m AI.export --check anh1.jpg anh2.jpg --backend onnx [--int8]
+'''
+import argparse, sys, cv2, numpy as np
+from contextlib import contextmanager
+from ultralytics import YOLO
+from AI import ai
+
+MODELS = (ai.REGION_MODEL, ai.BUBBLE_MODEL)
+
+def export_model(pt_path, fmt, int8=False, data=None):
+    model = YOLO(pt_path)
+    if fmt == "onnx":
+        # dynamic=True để chạy được batch (detect bubble / xác định góc xoay theo batch)
+        path = model.export(format="onnx", dynamic=True, simplify=True)
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            out = ai.get_model_path(pt_path, "onnx", True)
+            quantize_dynamic(path, str(out), weight_type=QuantType.QUInt8)
+            path = str(out)
+        return path
+    if fmt == "openvino":
+        # OpenVINO INT8 cần tập ảnh hiệu chỉnh (`data`, file yaml dataset của ultralytics)
+        return model.export(format="openvino", dynamic=True, int8=int8, data=data)
+    raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+
+def box_iou(a, b):
+    # IoU giữa từng cặp box của a (N x 4) và b (M x 4)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = ai.box_areas(a)[:, None]
+    area_b = ai.box_areas(b)[None, :]
+    return inter / np.maximum(area_a + area_b - inter, 1)
+
+def match_ratio(ref, other, iou_thres=0.5):
+    # Tỉ lệ box khớp (cùng class, IoU >= iou_thres) giữa 2 kết quả detect
+    n = max(len(ref["boxes"]), len(other["boxes"]))
+    if n == 0:
+        return 1.0
+    if not len(ref["boxes"]) or not len(other["boxes"]):
+        return 0.0
+    same = ref["classes"][:, None] == other["classes"][None, :]
+    matched = ((box_iou(ref["boxes"], other["boxes"]) >= iou_thres) & same).any(axis=1)
+    return matched.sum() / n
+
+@contextmanager
+def use_models(region_model, bubble_model):
+    old = dict(ai._models)
+    for slot in range(ai.AI_MAX_CONCURRENCY):
+        ai._models.update({(slot, ai.REGION_MODEL): region_model, (slot, ai.BUBBLE_MODEL): bubble_model})
+    try:
+        yield
+    finally:
+        ai._models.clear()
+        ai._models.update(old)
+
+def check_parity(images, backend, int8=False, iou_thres=0.5):
+    """
+    So sánh backend `backend` với backend torch trên các ảnh `images`:
+    tỉ lệ box khớp của từng model và kết quả đọc (SBD, Mã đề, đáp án) của cả pipeline.
+    Trả về True nếu kết quả đọc của mọi ảnh giống nhau.
+    """
+    ref_models = [ai.load_model(path, "torch") for path in MODELS]
+    other_models = [ai.load_model(path, backend, int8) for path in MODELS]
+    ok = True
+    for image in images:
+        img = cv2.imread(image)
+        if img is None:
+            print(f"{image}: không đọc được ảnh")
+            ok = False
+            continue
+
+        ratios = []
+        for ref_model, other_model in zip(ref_models, other_models):
+            ref = ai.parse_detections(ref_model(img, verbose=False)[0])
+            other = ai.parse_detections(other_model(img, verbose=False)[0])
+            ratios.append(match_ratio(ref, other, iou_thres))
+
+        with use_models(*ref_models):
+            ref_result, _ = ai.No_Le_AI().process(img)
+        with use_models(*other_models):
+            other_result, _ = ai.No_Le_AI().process(img)
+        same = ref_result == other_result
+        ok = ok and same
+        print(f"{image}: regions {ratios[0]:.1%}, bubbles {ratios[1]:.1%}, kết quả {'giống' if same else 'KHÁC'}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model YOLO và kiểm tra backend inference")
+    parser.add_argument("--format", choices=("onnx", "openvino"))
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--data", help="Dataset yaml để hiệu chỉnh INT8 cho OpenVINO")
+    parser.add_argument("--check", nargs="+", metavar="IMAGE", help="Ảnh dùng để so sánh với backend torch")
+    parser.add_argument("--backend", choices=ai.AI_BACKENDS[1:], default="onnx")
+    args = parser.parse_args()
+
+    if args.format:
+        for path in MODELS:
+            print(export_model(path, args.format, args.int8, args.data))
+    if args.check:
+        if not check_parity(args.check, args.backend, args.int8):
+            sys.exit(1)
+    if not args.format and not args.check:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# User của request JWT được cache theo (user id, version); tăng version (invalidate_user_cache)
+# khi đổi mật khẩu / đặt lại mật khẩu / xác thực email để các request sau đọc lại từ DB.
+USER_CACHE_TIMEOUT = 60
+
+def key_user_version(id) -> str:
+    return f"user:{{{id}}}:version"
+
+def key_user(id, version) -> str:
+    return f"user:{{{id}}}:v{version}"
+
+def invalidate_user_cache(user_id):
+    try:
+        cache.incr(key_user_version(user_id))
+    except ValueError:
+        cache.set(key_user_version(user_id), 1, timeout=None)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        key = key_user(user_id, cache.get(key_user_version(user_id), 0))
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user, timeout=USER_CACHE_TIMEOUT)
+            return user
+
+        # Các kiểm tra của JWTAuthentication.get_user, chạy lại trên user đã cache
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
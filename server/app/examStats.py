@@ -0,0 +1,241 @@
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q
+from .models import ExamAnswer, ExamineePaper, ExamineeRecord, ExamPaper
+from .packedAnswer import has_packed_answers, record_answers
+
+# Thống kê đề thi được cache dưới dạng các tổng cộng dồn được (state), nên khi lưu thêm 1 bài
+# chỉ cần cộng / trừ phần đóng góp của bài đó thay vì tính lại cả đề:
+#   n               số bài
+#   correct_hist    số bài theo số câu đúng t (0..questions)
+#   item_correct    số bài đúng từng câu
+#   option_counts   số bài chọn từng đáp án (A..D) của từng câu, không tính câu bỏ trống
+#   item_total      tổng x_i * t theo câu (x_i: đúng câu i), dùng cho point-biserial
+STATS_TIMEOUT = 60 * 60 * 24
+OPTIONS = 4
+SCORE_BINS = np.arange(0, 11)
+
+def key_paper_stats(id) -> str:
+    return f"stats:{{{id}}}:paper"
+
+def key_paper_stats_lock(id) -> str:
+    return f"stats:{{{id}}}:lock"
+
+def paper_lock(exam_paper_id):
+    return cache.lock(key_paper_stats_lock(exam_paper_id), timeout=60, blocking_timeout=30)
+
+def empty_state(questions):
+    return {
+        "questions": questions,
+        "n": 0,
+        "correct_hist": np.zeros(questions + 1, dtype=np.int64),
+        "item_correct": np.zeros(questions, dtype=np.int64),
+        "option_counts": np.zeros((questions, OPTIONS), dtype=np.int64),
+        "item_total": np.zeros(questions, dtype=np.int64),
+    }
+
+def add_sheets(state, answers, marks, sign=1):
+    # Cộng (sign=1) hoặc trừ (sign=-1) các bài `answers`, `marks` (N x questions, -1 / False nếu bỏ trống)
+    answers = np.atleast_2d(answers)
+    marks = np.atleast_2d(marks).astype(np.int64)
+    totals = marks.sum(axis=1)
+    state["n"] += sign * len(answers)
+    np.add.at(state["correct_hist"], totals, sign)
+    state["item_correct"] += sign * marks.sum(axis=0)
+    state["item_total"] += sign * (marks * totals[:, None]).sum(axis=0)
+    rows, cols = np.nonzero((answers >= 0) & (answers < OPTIONS))
+    np.add.at(state["option_counts"], (cols, answers[rows, cols]), sign)
+
+def load_answer_matrix(exam_paper):
+    """
+    Bài làm của mọi thí sinh làm `exam_paper`: (answers, marks) dạng mảng N x số câu.
+    Gồm bài đã lưu gọn trên ExamineeRecord và bài cũ trong ExamineePaper.
+    """
+    records = list(ExamineeRecord.objects.filter(
+        Q(exam_paper=exam_paper) | Q(exam_paper__isnull=True),
+        exam_id=exam_paper.exam_id,
+    ))
+    packed = [record_answers(rec) for rec in records if has_packed_answers(rec) and rec.exam_paper_id == exam_paper.id]
+    legacy_examinees = [rec.examinee_id for rec in records if not has_packed_answers(rec)]
+    rows = np.array(
+        list(
+            ExamineePaper.objects
+            .filter(exam_paper=exam_paper, examinee_id__in=legacy_examinees)
+            .order_by('pk')
+            .values_list('examinee_id', 'question_number', 'answer_number', 'mark_result')
+        ),
+        dtype=np.int64
+    ).reshape(-1, 4)
+    # Mỗi câu lấy dòng đầu tiên (giống save_exam_result)
+    _, first = np.unique(rows[:, :2], axis=0, return_index=True)
+    rows = rows[first]
+    rows = rows[rows[:, 1] >= 1]
+
+    questions = max([exam_paper.number_of_questions, int(rows[:, 1].max()) if len(rows) else 0] + [len(a) for a, _ in packed])
+    examinees, row_index = np.unique(rows[:, 0], return_inverse=True)
+    answers = np.full((len(packed) + len(examinees), questions), -1, dtype=np.int64)
+    marks = np.zeros(answers.shape, dtype=bool)
+    for i, (a, m) in enumerate(packed):
+        answers[i, :len(a)] = a
+        marks[i, :len(m)] = m
+    answers[len(packed) + row_index, rows[:, 1] - 1] = rows[:, 2]
+    marks[len(packed) + row_index, rows[:, 1] - 1] = rows[:, 3].astype(bool)
+    return answers, marks
+
+def build_paper_state(exam_paper):
+    answers, marks = load_answer_matrix(exam_paper)
+    state = empty_state(answers.shape[1])
+    if len(answers):
+        add_sheets(state, answers, marks)
+    return state
+
+def get_paper_state(exam_paper):
+    state = cache.get(key_paper_stats(exam_paper.id))
+    if state is None:
+        with paper_lock(exam_paper.id):
+            state = cache.get(key_paper_stats(exam_paper.id))
+            if state is None:
+                state = build_paper_state(exam_paper)
+                cache.set(key_paper_stats(exam_paper.id), state, timeout=STATS_TIMEOUT)
+    return state
+
+def invalidate_paper_stats(exam_paper_id):
+    with paper_lock(exam_paper_id):
+        cache.delete(key_paper_stats(exam_paper_id))
+
+def invalidate_exam_stats(exam_id):
+    for exam_paper_id in ExamPaper.objects.filter(exam_id=exam_id).values_list('id', flat=True):
+        invalidate_paper_stats(exam_paper_id)
+
+def record_sheet(record):
+    # (đề, câu trả lời, kết quả) của bản ghi đã lưu gọn, None nếu không có
+    if not has_packed_answers(record) or record.exam_paper_id is None:
+        return None
+    answers, marks = record_answers(record)
+    return record.exam_paper_id, answers.astype(np.int64), marks
+
+def apply_sheet(sheet, sign):
+    # Cập nhật state đã cache với 1 bài; state chưa có thì để lần đọc sau tự tính
+    exam_paper_id, answers, marks = sheet
+    with paper_lock(exam_paper_id):
+        state = cache.get(key_paper_stats(exam_paper_id))
+        if state is None:
+            return
+        if len(answers) > state["questions"]:
+            cache.delete(key_paper_stats(exam_paper_id))
+            return
+        padded_answers = np.full(state["questions"], -1, dtype=np.int64)
+        padded_answers[:len(answers)] = answers
+        padded_marks = np.zeros(state["questions"], dtype=bool)
+        padded_marks[:len(marks)] = marks
+        add_sheets(state, padded_answers, padded_marks, sign)
+        cache.set(key_paper_stats(exam_paper_id), state, timeout=STATS_TIMEOUT)
+
+def update_sheet_stats(exam_id, exam_paper_id, old_sheet, old_graded, new_sheet):
+    """
+    Cập nhật thống kê sau khi lưu lại 1 bài: trừ bài cũ (nếu có) và cộng bài mới.
+    Nếu không biết đóng góp của bài cũ / mới (bài không lưu gọn) thì xoá cache để tính lại.
+    """
+    if old_sheet:
+        apply_sheet(old_sheet, -1)
+    elif old_graded:
+        invalidate_exam_stats(exam_id)
+    if new_sheet:
+        apply_sheet(new_sheet, 1)
+    else:
+        invalidate_paper_stats(exam_paper_id)
+
+def remove_record_stats(exam_id, sheet, graded):
+    # Sau khi xoá 1 bản ghi: trừ bài đã lưu gọn, bài không lưu gọn thì tính lại thống kê cả kỳ thi
+    if sheet:
+        apply_sheet(sheet, -1)
+    elif graded:
+        invalidate_exam_stats(exam_id)
+
+def score_summary(scores, weights):
+    # Phân bố điểm và các đại lượng cơ bản từ các mức điểm `scores` với số bài `weights`
+    n = int(weights.sum())
+    histogram, _ = np.histogram(scores, bins=SCORE_BINS, weights=weights)
+    summary = {
+        "count": n,
+        "histogram": [{"from": int(SCORE_BINS[i]), "to": int(SCORE_BINS[i + 1]), "count": int(c)} for i, c in enumerate(histogram)],
+        "mean": None, "median": None, "std": None, "min": None, "max": None,
+    }
+    if n:
+        order = np.argsort(scores, kind='stable')
+        scores, weights = scores[order], weights[order]
+        cumulative = np.cumsum(weights)
+        lower = scores[np.searchsorted(cumulative, (n + 1) // 2)]
+        upper = scores[np.searchsorted(cumulative, n // 2 + 1)]
+        mean = float((scores * weights).sum() / n)
+        present = scores[weights > 0]
+        summary.update({
+            "mean": mean,
+            "median": float((lower + upper) / 2),
+            "std": float(np.sqrt((weights * (scores - mean) ** 2).sum() / n)),
+            "min": float(present.min()),
+            "max": float(present.max()),
+        })
+    return summary
+
+def paper_scores(exam_paper, state):
+    # Điểm ứng với từng số câu đúng t (công thức của save_exam_result)
+    correct = np.arange(state["questions"] + 1)
+    if exam_paper.number_of_questions <= 0:
+        return np.zeros(len(correct))
+    return correct / exam_paper.number_of_questions * 10
+
+def question_stats(exam_paper, state):
+    n = state["n"]
+    key = dict(ExamAnswer.objects.filter(exam_paper=exam_paper).values_list('question_number', 'answer_number'))
+    totals = np.arange(state["questions"] + 1)
+    sum_t = float((state["correct_hist"] * totals).sum())
+    sum_t2 = float((state["correct_hist"] * totals ** 2).sum())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = state["item_correct"] / n if n else np.zeros(state["questions"])
+        mean_t = sum_t / n if n else 0.0
+        var_t = sum_t2 / n - mean_t ** 2 if n else 0.0
+        # Point-biserial giữa đúng/sai câu i và tổng số câu đúng
+        cov = state["item_total"] / n - p * mean_t if n else np.zeros(state["questions"])
+        point_biserial = cov / np.sqrt(p * (1 - p) * var_t)
+
+    out = []
+    for i in range(state["questions"]):
+        out.append({
+            "question_number": i + 1,
+            "correct_answer": key.get(i + 1),
+            "correct_rate": float(p[i]) if n else None,
+            "option_counts": {chr(ord('A') + o): int(state["option_counts"][i, o]) for o in range(OPTIONS)},
+            "blank": int(n - state["option_counts"][i].sum()),
+            "point_biserial": float(point_biserial[i]) if np.isfinite(point_biserial[i]) else None,
+        })
+    return out
+
+def paper_statistics(exam_paper):
+    state = get_paper_state(exam_paper)
+    return {
+        "exam_paper": exam_paper.id,
+        "exam_paper_code": exam_paper.exam_paper_code,
+        "number_of_questions": exam_paper.number_of_questions,
+        "scores": score_summary(paper_scores(exam_paper, state), state["correct_hist"]),
+        "questions": question_stats(exam_paper, state),
+    }
+
+def exam_statistics(exam):
+    # Phân bố điểm của cả kỳ thi gộp từ state của từng đề
+    papers = list(ExamPaper.objects.filter(exam=exam).order_by('id'))
+    scores, weights, paper_list = [], [], []
+    for exam_paper in papers:
+        state = get_paper_state(exam_paper)
+        scores.append(paper_scores(exam_paper, state))
+        weights.append(state["correct_hist"])
+        paper_list.append({
+            "exam_paper": exam_paper.id,
+            "exam_paper_code": exam_paper.exam_paper_code,
+            "scores": score_summary(scores[-1], state["correct_hist"]),
+        })
+    return {
+        "exam": exam.id,
+        "scores": score_summary(np.concatenate(scores) if scores else np.zeros(0), np.concatenate(weights) if weights else np.zeros(0, dtype=np.int64)),
+        "papers": paper_list,
+    }
@@ -0,0 +1,106 @@
+import csv
+import datetime
+from django.db import IntegrityError, transaction
+from .models import Examinee, ExamineeRecord
+from .serializers import ExamineeImportRowSerializer
+from .spreadsheet import SpreadsheetError, chunked, read_rows
+from .grading import BULK_BATCH_SIZE
+
+IMPORT_COLUMNS = ('student_ID', 'name', 'date_of_birth')
+IMPORT_CHUNK_ATTEMPTS = 3
+
+def clean_value(value):
+    # Giá trị ô XLSX: datetime -> date, số -> chuỗi (vd. SBD 123 -> "123")
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+def import_examinees(user, file, mode='skip', exam=None):
+    """
+    Nhập thí sinh của `user` từ file CSV / XLSX (cột student_ID, name, date_of_birth).
+    Đọc và kiểm tra theo từng chunk; thí sinh đã có (cùng student_ID) được bỏ qua (mode=skip)
+    hoặc cập nhật (mode=update). Nếu có `exam`, tạo ExamineeRecord cho các thí sinh chưa có bản ghi.
+    Trả về số dòng tạo mới / cập nhật / bỏ qua, số bản ghi tạo mới và lỗi theo từng dòng.
+    """
+    report = {"created": 0, "updated": 0, "skipped": 0, "records_created": 0, "errors": []}
+    seen = set()
+    try:
+        # read_rows đọc luôn dòng tiêu đề, nên lỗi giải mã (vd. CSV UTF-16) có thể xảy ra ngay tại đây
+        header, rows = read_rows(file)
+        missing = [column for column in IMPORT_COLUMNS if column not in header]
+        if missing:
+            raise SpreadsheetError(f"Thiếu cột: {', '.join(missing)}")
+
+        for chunk in chunked(rows, BULK_BATCH_SIZE):
+            # Kiểm tra từng dòng
+            valid = {}
+            for line, row in chunk:
+                serializer = ExamineeImportRowSerializer(data={column: clean_value(row.get(column)) for column in IMPORT_COLUMNS})
+                if not serializer.is_valid():
+                    report["errors"].append({"row": line, "errors": serializer.errors})
+                    continue
+                student_ID = serializer.validated_data['student_ID']
+                if student_ID in seen:
+                    report["errors"].append({"row": line, "errors": {"student_ID": ["student_ID bị trùng trong file"]}})
+                    continue
+                seen.add(student_ID)
+                valid[student_ID] = (line, serializer.validated_data)
+            if valid:
+                import_chunk(user, valid, mode, exam, report)
+    except UnicodeDecodeError:
+        raise SpreadsheetError("File CSV phải dùng mã hoá UTF-8")
+    except csv.Error:
+        raise SpreadsheetError("File CSV không hợp lệ")
+    return report
+
+def import_chunk(user, valid, mode, exam, report):
+    # Lần nhập khác chạy đồng thời có thể tạo trước cùng thí sinh / bản ghi (IntegrityError):
+    # chạy lại cả chunk, lần sau các dòng đó đã có nên được bỏ qua hoặc cập nhật như bình thường
+    for attempt in range(IMPORT_CHUNK_ATTEMPTS):
+        try:
+            counts = save_chunk(user, valid, mode, exam)
+        except IntegrityError:
+            continue
+        for name, count in counts.items():
+            report[name] += count
+        return
+    for line, _ in valid.values():
+        report["errors"].append({"row": line, "errors": {"student_ID": ["Đang được nhập đồng thời, vui lòng thử lại"]}})
+
+def save_chunk(user, valid, mode, exam):
+    counts = {"created": 0, "updated": 0, "skipped": 0, "records_created": 0}
+    with transaction.atomic():
+        existing = {
+            examinee.student_ID: examinee
+            for examinee in Examinee.objects.select_for_update().filter(user=user, student_ID__in=list(valid))
+        }
+        to_create = []
+        to_update = []
+        for student_ID, (_, data) in valid.items():
+            examinee = existing.get(student_ID)
+            if not examinee:
+                to_create.append(Examinee(user=user, **data))
+            elif mode == 'update' and (examinee.name, examinee.date_of_birth) != (data['name'], data['date_of_birth']):
+                examinee.name = data['name']
+                examinee.date_of_birth = data['date_of_birth']
+                to_update.append(examinee)
+            else:
+                counts["skipped"] += 1
+        Examinee.objects.bulk_update(to_update, ['name', 'date_of_birth'], batch_size=BULK_BATCH_SIZE)
+        Examinee.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+        counts["created"] = len(to_create)
+        counts["updated"] = len(to_update)
+
+        if exam is not None:
+            # Không phải DB nào cũng trả id sau bulk_create nên lấy lại id theo student_ID
+            examinee_ids = set(Examinee.objects.filter(user=user, student_ID__in=list(valid)).values_list('id', flat=True))
+            examinee_ids -= set(ExamineeRecord.objects.filter(exam=exam, examinee_id__in=examinee_ids).values_list('examinee_id', flat=True))
+            ExamineeRecord.objects.bulk_create([ExamineeRecord(exam=exam, examinee_id=examinee_id) for examinee_id in examinee_ids], batch_size=BULK_BATCH_SIZE)
+            counts["records_created"] = len(examinee_ids)
+    return counts
@@ -0,0 +1,168 @@
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from django.conf import settings
+from .models import *
+from .packedAnswer import BLANK_NUMBER, is_packable, pack_answers
+from .examStats import record_sheet, update_sheet_stats
+from .leaderboard import update_score
+
+BULK_BATCH_SIZE = 500
+
+class GradingError(APIException):
+    # Trả về 400 {"detail": ...} giống các response lỗi khác
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Lưu kết quả bài thi thất bại"
+
+ANSWER_CHOICES = ('A', 'B', 'C', 'D')
+BLANK_ANSWER = '?'
+
+def parse_answer(ans_char):
+    if ans_char == BLANK_ANSWER:
+        return BLANK_NUMBER
+    if ans_char not in ANSWER_CHOICES:
+        raise GradingError(f"Câu trả lời không hợp lệ: {ans_char}")
+    return ANSWER_CHOICES.index(ans_char)
+
+def parse_question_number(q_num_str):
+    try:
+        question_number = int(q_num_str)
+    except (TypeError, ValueError):
+        question_number = 0
+    if question_number < 1:
+        raise GradingError(f"Số câu không hợp lệ: {q_num_str}")
+    return question_number
+
+def find_grading_target(user, exam, result):
+    """
+    Tìm thí sinh, bản ghi thí sinh và đề thi ứng với `result` (sbd, made) trong kỳ thi `exam`.
+    Raise GradingError nếu không tìm thấy.
+    """
+    student_ID = result.get('sbd', None)
+    examinee = Examinee.objects.filter(user=user, student_ID=student_ID).first() if student_ID else None
+    if not examinee:
+        raise GradingError("Không tìm thấy thí sinh")
+
+    examineeRecord = ExamineeRecord.objects.filter(exam=exam, examinee=examinee).first()
+    if not examineeRecord:
+        raise GradingError("Không tìm thấy bản ghi thí sinh")
+
+    # Lấy đề thi từ ExamPaper
+    exam_paper = ExamPaper.objects.filter(exam=exam, exam_paper_code=result.get('made', None)).first()
+    if not exam_paper:
+        raise GradingError("Không tìm thấy đề thi")
+
+    return examinee, examineeRecord, exam_paper
+
+def save_exam_result(examinee, examineeRecord, exam_paper, answers, original_image=None, processed_image=None):
+    """
+    Chấm `answers` ({"1": "A", ...}) theo đáp án của `exam_paper`, lưu gọn bài làm trên ExamineeRecord
+    (và vào ExamineePaper nếu STORE_EXAMINEE_PAPER_ROWS bật).
+    `original_image`, `processed_image`: key ảnh trên S3 (nếu có).
+    Trả về (số câu đúng, điểm).
+    """
+    # Lấy đáp án đúng từ ExamAnswer
+    correct_answers = ExamAnswer.objects.filter(exam_paper=exam_paper)
+    correct_answer_dict = {ans.question_number: ans.answer_number for ans in correct_answers}
+
+    # Bài cũ của bản ghi, để cập nhật thống kê đề thi
+    old_sheet = record_sheet(examineeRecord)
+    old_graded = examineeRecord.score is not None
+
+    # Kiểm tra và lưu đáp án vào ExamineePaper
+    with transaction.atomic():
+        if original_image:
+            examineeRecord.original_image = original_image
+        if processed_image:
+            examineeRecord.processed_image = processed_image
+
+        # Chấm từng câu
+        graded = {}
+        for q_num_str, ans_char in (answers or {}).items():
+            question_number = parse_question_number(q_num_str)
+            answer_number = parse_answer(ans_char)
+            mark_result = question_number in correct_answer_dict and answer_number == correct_answer_dict[question_number]
+            graded[question_number] = (answer_number, mark_result)
+        correct_count = sum(mark_result for _, mark_result in graded.values())
+
+        # Lưu gọn bài làm trên ExamineeRecord
+        examineeRecord.exam_paper = exam_paper
+        examineeRecord.packed_answers = examineeRecord.correct_bitmap = examineeRecord.blank_bitmap = examineeRecord.question_count = None
+        if is_packable(list(graded)):
+            question_numbers = sorted(graded)
+            examineeRecord.packed_answers, examineeRecord.correct_bitmap, examineeRecord.blank_bitmap = pack_answers(
+                [graded[q][0] for q in question_numbers], [graded[q][1] for q in question_numbers]
+            )
+            examineeRecord.question_count = len(question_numbers)
+        elif not graded:
+            examineeRecord.packed_answers, examineeRecord.correct_bitmap, examineeRecord.blank_bitmap = pack_answers([], [])
+            examineeRecord.question_count = 0
+
+        if settings.STORE_EXAMINEE_PAPER_ROWS or examineeRecord.question_count is None:
+            save_examinee_paper_rows(examinee, exam_paper, graded)
+
+        # Tính điểm
+        score = (correct_count / exam_paper.number_of_questions) * 10 if exam_paper.number_of_questions > 0 else 0
+
+        # Cập nhật ExamineeRecord
+        examineeRecord.score = score
+        examineeRecord.save()
+
+        new_sheet = record_sheet(examineeRecord)
+        transaction.on_commit(lambda: update_sheet_stats(exam_paper.exam_id, exam_paper.id, old_sheet, old_graded, new_sheet))
+        transaction.on_commit(lambda: update_score(examineeRecord.exam_id, examineeRecord.examinee_id, score))
+
+    return correct_count, score
+
+def save_examinee_paper_rows(examinee, exam_paper, graded):
+    # Lưu từng câu vào ExamineePaper (graded: {question_number: (answer_number, mark_result)})
+    # Lấy các đáp án đã lưu của thí sinh trong 1 query
+    existing = {}
+    for examinee_answer in ExamineePaper.objects.filter(exam_paper=exam_paper, examinee=examinee).order_by('pk'):
+        existing.setdefault(examinee_answer.question_number, examinee_answer)
+
+    # bulk_create / bulk_update
+    to_create = []
+    to_update = []
+    for question_number, (answer_number, mark_result) in graded.items():
+        examinee_answer = existing.get(question_number)
+        if examinee_answer:
+            if examinee_answer.answer_number != answer_number or examinee_answer.mark_result != mark_result:
+                examinee_answer.answer_number = answer_number
+                examinee_answer.mark_result = mark_result
+                to_update.append(examinee_answer)
+            continue
+        to_create.append(ExamineePaper(exam_paper=exam_paper, examinee=examinee, question_number=question_number, answer_number=answer_number, mark_result=mark_result))
+
+    ExamineePaper.objects.bulk_update(to_update, ['answer_number', 'mark_result'], batch_size=BULK_BATCH_SIZE)
+    ExamineePaper.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+
+def save_exam_answers(exam_paper, answers):
+    """
+    Ghi đáp án `answers` ([{"question_number", "answer_number"}, ...]) của `exam_paper` theo kiểu upsert
+    với số query cố định. Trả về số đáp án được tạo mới, được cập nhật và không đổi.
+    """
+    with transaction.atomic():
+        existing = {}
+        for exam_answer in ExamAnswer.objects.filter(exam_paper=exam_paper).order_by('pk'):
+            existing.setdefault(exam_answer.question_number, exam_answer)
+
+        to_create = []
+        to_update = []
+        unchanged = 0
+        for ans in answers:
+            question_number = ans['question_number']
+            answer_number = ans['answer_number']
+            exam_answer = existing.get(question_number)
+            if not exam_answer:
+                to_create.append(ExamAnswer(exam_paper=exam_paper, question_number=question_number, answer_number=answer_number))
+            elif exam_answer.answer_number != answer_number:
+                exam_answer.answer_number = answer_number
+                to_update.append(exam_answer)
+            else:
+                unchanged += 1
+
+        ExamAnswer.objects.bulk_update(to_update, ['answer_number'], batch_size=BULK_BATCH_SIZE)
+        ExamAnswer.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+
+    return {"created": len(to_create), "updated": len(to_update), "unchanged": unchanged}
@@ -0,0 +1,126 @@
+from django_redis import get_redis_connection
+from .models import ExamineeRecord
+
+# Bảng xếp hạng mỗi kỳ thi là 1 sorted set trong Redis: member = examinee id, score = điểm.
+# Được cập nhật khi lưu / chấm lại bài; mất dữ liệu thì tự dựng lại từ DB (hoặc `rebuild_leaderboards`).
+REBUILD_TIMEOUT = 60
+
+def key_leaderboard(id) -> str:
+    return f"leaderboard:{{{id}}}"
+
+def key_leaderboard_tmp(id) -> str:
+    return f"leaderboard:{{{id}}}:tmp"
+
+def key_leaderboard_pending(id) -> str:
+    # Hash examinee id -> điểm ("" là xoá), các cập nhật đến trong lúc dựng lại bảng
+    return f"leaderboard:{{{id}}}:pending"
+
+def key_leaderboard_rebuilding(id) -> str:
+    return f"leaderboard:{{{id}}}:rebuilding"
+
+def key_leaderboard_lock(id) -> str:
+    return f"leaderboard:{{{id}}}:lock"
+
+def get_connection():
+    return get_redis_connection("default")
+
+def write_scores(pipe, key, scores):
+    # scores: {examinee_id: điểm hoặc None (xoá khỏi bảng)}
+    ranked = {examinee_id: score for examinee_id, score in scores.items() if score is not None}
+    removed = [examinee_id for examinee_id, score in scores.items() if score is None]
+    if ranked:
+        pipe.zadd(key, ranked)
+    if removed:
+        pipe.zrem(key, *removed)
+
+def rebuild_leaderboard(exam_id):
+    """
+    Dựng lại bảng xếp hạng của kỳ thi từ ExamineeRecord, trả về số thí sinh có điểm.
+    Điểm lưu trong lúc đọc DB có thể không có trong kết quả đọc: trong lúc dựng, update_scores ghi thêm
+    vào hash `pending`; bảng mới được dựng ở key tạm, RENAME sang key chính rồi áp lại `pending`.
+    """
+    conn = get_connection()
+    key, tmp = key_leaderboard(exam_id), key_leaderboard_tmp(exam_id)
+    pending, rebuilding = key_leaderboard_pending(exam_id), key_leaderboard_rebuilding(exam_id)
+    with conn.lock(key_leaderboard_lock(exam_id), timeout=REBUILD_TIMEOUT, blocking_timeout=30):
+        pipe = conn.pipeline()
+        pipe.delete(pending)
+        pipe.set(rebuilding, 1, ex=REBUILD_TIMEOUT)
+        pipe.execute()
+
+        scores = dict(
+            ExamineeRecord.objects
+            .filter(exam_id=exam_id, score__isnull=False)
+            .values_list('examinee_id', 'score')
+        )
+        pipe = conn.pipeline()
+        pipe.delete(tmp)
+        if scores:
+            pipe.zadd(tmp, scores)
+            pipe.rename(tmp, key)
+        else:
+            pipe.delete(key)
+        pipe.execute()
+
+        def apply_pending(pipe):
+            updates = {int(examinee_id): float(score) if score else None for examinee_id, score in pipe.hgetall(pending).items()}
+            pipe.multi()
+            write_scores(pipe, key, updates)
+            pipe.delete(pending, rebuilding)
+        conn.transaction(apply_pending, pending)
+    return len(scores)
+
+def ensure_leaderboard(exam_id):
+    conn = get_connection()
+    if not conn.exists(key_leaderboard(exam_id)):
+        rebuild_leaderboard(exam_id)
+    return conn
+
+def update_scores(exam_id, scores):
+    # scores: {examinee_id: điểm hoặc None (xoá khỏi bảng)}; chưa có bảng thì để lần đọc sau tự dựng
+    if not scores:
+        return
+    key, pending, rebuilding = key_leaderboard(exam_id), key_leaderboard_pending(exam_id), key_leaderboard_rebuilding(exam_id)
+
+    def write(pipe):
+        is_rebuilding, exists = pipe.exists(rebuilding), pipe.exists(key)
+        pipe.multi()
+        if is_rebuilding:
+            pipe.hset(pending, mapping={examinee_id: '' if score is None else score for examinee_id, score in scores.items()})
+        if exists:
+            write_scores(pipe, key, scores)
+    get_connection().transaction(write, rebuilding, key)
+
+def update_score(exam_id, examinee_id, score):
+    update_scores(exam_id, {examinee_id: score})
+
+def top(exam_id, n):
+    # N thí sinh điểm cao nhất: [(examinee_id, điểm, hạng)], cùng điểm thì cùng hạng
+    conn = ensure_leaderboard(exam_id)
+    out = []
+    for i, (member, score) in enumerate(conn.zrevrange(key_leaderboard(exam_id), 0, n - 1, withscores=True)):
+        rank = out[-1][2] if out and out[-1][1] == score else i + 1
+        out.append((int(member), score, rank))
+    return out, conn.zcard(key_leaderboard(exam_id))
+
+def rank(exam_id, examinee_id):
+    """
+    Hạng của thí sinh (1 + số thí sinh điểm cao hơn) và percentile (% thí sinh điểm thấp hơn).
+    Trả về None nếu thí sinh chưa có điểm.
+    """
+    conn = ensure_leaderboard(exam_id)
+    key = key_leaderboard(exam_id)
+    score = conn.zscore(key, examinee_id)
+    if score is None:
+        return None
+    pipe = conn.pipeline()
+    pipe.zcount(key, f"({score}", "+inf")
+    pipe.zcount(key, "-inf", f"({score}")
+    pipe.zcard(key)
+    higher, lower, total = pipe.execute()
+    return {
+        "score": score,
+        "rank": higher + 1,
+        "total": total,
+        "percentile": lower / total * 100,
+    }
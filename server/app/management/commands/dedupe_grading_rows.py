@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from app.models import ExamAnswer, ExamineePaper, ExamineeRecord
+
+# Bảng và các trường của unique constraint tương ứng
+DEDUPE_TARGETS = (
+    (ExamAnswer, ('exam_paper', 'question_number')),
+    (ExamineePaper, ('exam_paper', 'examinee', 'question_number')),
+    (ExamineeRecord, ('exam', 'examinee')),
+)
+
+class Command(BaseCommand):
+    help = "Xoá các dòng trùng trong ExamAnswer, ExamineePaper, ExamineeRecord (chạy trước khi migrate unique constraint)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Chỉ đếm, không xoá")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        with transaction.atomic():
+            for model, fields in DEDUPE_TARGETS:
+                groups = (
+                    model.objects
+                    .values(*fields)
+                    .annotate(n=Count('id'))
+                    .filter(n__gt=1)
+                    .order_by()
+                )
+                stale_ids = []
+                for group in groups:
+                    # Giữ dòng có id nhỏ nhất: trước đây code luôn đọc/cập nhật dòng này (`.first()`)
+                    ids = list(
+                        model.objects
+                        .filter(**{field: group[field] for field in fields})
+                        .order_by('id')
+                        .values_list('id', flat=True)
+                    )
+                    stale_ids.extend(ids[1:])
+
+                if stale_ids and not dry_run:
+                    model.objects.filter(id__in=stale_ids).delete()
+                action = "Sẽ xoá" if dry_run else "Đã xoá"
+                self.stdout.write(f"{model.__name__}: {action} {len(stale_ids)} dòng trùng")
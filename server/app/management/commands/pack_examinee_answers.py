@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.models import ExamineePaper, ExamineeRecord
+from app.packedAnswer import is_packable, pack_answers
+
+CHUNK_SIZE = 500
+
+class Command(BaseCommand):
+    help = "Chuyển bài làm trong ExamineePaper sang dạng lưu gọn trên ExamineeRecord"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, help="Chỉ xử lý kỳ thi có id này")
+        parser.add_argument('--delete-rows', action='store_true', help="Xoá các dòng ExamineePaper đã được lưu gọn")
+
+    def handle(self, *args, **options):
+        records = ExamineeRecord.objects.filter(packed_answers__isnull=True).order_by('id')
+        if options['exam']:
+            records = records.filter(exam_id=options['exam'])
+        record_ids = list(records.values_list('id', flat=True))
+
+        packed = skipped = deleted = 0
+        for start in range(0, len(record_ids), CHUNK_SIZE):
+            with transaction.atomic():
+                chunk = list(ExamineeRecord.objects.filter(id__in=record_ids[start:start + CHUNK_SIZE]))
+                # Bài làm của cả chunk trong 1 query: {(examinee, exam): {exam_paper: {question_number: row}}}
+                rows = {}
+                for row in (
+                    ExamineePaper.objects
+                    .filter(examinee_id__in={rec.examinee_id for rec in chunk}, exam_paper__exam_id__in={rec.exam_id for rec in chunk})
+                    .select_related('exam_paper')
+                    .order_by('pk')
+                ):
+                    papers = rows.setdefault((row.examinee_id, row.exam_paper.exam_id), {})
+                    papers.setdefault(row.exam_paper_id, {}).setdefault(row.question_number, row)
+
+                to_update = []
+                row_ids = []
+                for rec in chunk:
+                    papers = rows.get((rec.examinee_id, rec.exam_id), {})
+                    # Chỉ lưu gọn khi thí sinh làm đúng 1 đề và các câu liên tiếp 1..N
+                    if len(papers) != 1:
+                        skipped += 1
+                        continue
+                    exam_paper_id, answers = next(iter(papers.items()))
+                    if not is_packable(list(answers)):
+                        skipped += 1
+                        continue
+                    question_numbers = sorted(answers)
+                    rec.exam_paper_id = exam_paper_id
+                    rec.packed_answers, rec.correct_bitmap, rec.blank_bitmap = pack_answers(
+                        [answers[q].answer_number for q in question_numbers],
+                        [answers[q].mark_result for q in question_numbers],
+                    )
+                    rec.question_count = len(question_numbers)
+                    to_update.append(rec)
+                    row_ids.extend(row.id for row in answers.values())
+
+                ExamineeRecord.objects.bulk_update(to_update, ['exam_paper', 'packed_answers', 'correct_bitmap', 'blank_bitmap', 'question_count'], batch_size=CHUNK_SIZE)
+                packed += len(to_update)
+                if options['delete_rows'] and row_ids:
+                    deleted += ExamineePaper.objects.filter(id__in=row_ids).delete()[0]
+
+        self.stdout.write(f"Đã lưu gọn {packed} bản ghi, bỏ qua {skipped} bản ghi, xoá {deleted} dòng ExamineePaper")
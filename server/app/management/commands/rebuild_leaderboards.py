@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app.models import Exam
+from app.leaderboard import rebuild_leaderboard
+
+class Command(BaseCommand):
+    help = "Dựng lại bảng xếp hạng (Redis sorted set) của các kỳ thi từ ExamineeRecord"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, help="Chỉ dựng lại kỳ thi có id này")
+
+    def handle(self, *args, **options):
+        exams = Exam.objects.order_by('id')
+        if options['exam']:
+            exams = exams.filter(pk=options['exam'])
+        for exam_id in exams.values_list('id', flat=True):
+            count = rebuild_leaderboard(exam_id)
+            self.stdout.write(f"Kỳ thi {exam_id}: {count} thí sinh")
@@ -48,6 +48,17 @@ class ExamineeRecord(models.Model):
     score = models.FloatField(null=True)
     original_image = models.CharField(max_length=255, null=True)
     processed_image = models.CharField(max_length=255, null=True)
+    # Đề thí sinh đã làm và bài làm lưu gọn (xem app/packedAnswer.py)
+    exam_paper = models.ForeignKey(ExamPaper, on_delete=models.SET_NULL, null=True, blank=True)
+    packed_answers = models.BinaryField(null=True)
+    correct_bitmap = models.BinaryField(null=True)
+    blank_bitmap = models.BinaryField(null=True)
+    question_count = models.IntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['exam', 'examinee'], name='unique_examinee_record_per_exam')
+        ]
     
     def __str__(self):
         return f"{self.examinee.name} - {self.exam.name}: {self.score}"
@@ -56,6 +67,11 @@ class ExamAnswer(models.Model):
     exam_paper = models.ForeignKey(ExamPaper, on_delete=models.CASCADE)
     question_number = models.IntegerField()
     answer_number = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(3)])
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['exam_paper', 'question_number'], name='unique_exam_answer_per_question')
+        ]
     
     def __str__(self):
         return f"{self.exam_paper} Q{self.question_number}: A{self.answer_number}"
@@ -64,9 +80,18 @@ class ExamineePaper(models.Model):
     exam_paper = models.ForeignKey(ExamPaper, on_delete=models.CASCADE)
     examinee = models.ForeignKey(Examinee, on_delete=models.CASCADE)
     question_number = models.IntegerField()
-    answer_number = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(3)])
+    answer_number = models.IntegerField(validators=[MinValueValidator(-1), MaxValueValidator(3)]) # -1: bỏ trống
     mark_result = models.BooleanField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['exam_paper', 'examinee', 'question_number'], name='unique_examinee_paper_question')
+        ]
+        indexes = [
+            # Tra cứu bài làm theo thí sinh + kỳ thi (examinee, exam_paper__exam) và đếm câu đúng
+            models.Index(fields=['examinee', 'exam_paper', 'mark_result'], name='examineepaper_examinee_paper'),
+        ]
+
     def __str__(self):
         mark = "Correct" if self.mark_result else "Wrong"
         return f"{self.examinee.name} - {self.exam_paper} Q{self.question_number}: A{self.answer_number} ({mark})"
@@ -0,0 +1,49 @@
+import numpy as np
+
+BLANK_NUMBER = -1
+
+# Lưu gọn bài làm của 1 thí sinh trên ExamineeRecord:
+# - packed_answers: mỗi câu 2 bit (answer_number 0..3), 4 câu / byte
+# - correct_bitmap: mỗi câu 1 bit (mark_result)
+# - blank_bitmap: mỗi câu 1 bit (bỏ trống, answer_number = BLANK_NUMBER), None với bản ghi cũ
+# Câu i (bắt đầu từ 1) nằm ở vị trí i - 1, vì vậy chỉ dùng khi các câu là 1..N liên tiếp.
+
+def is_packable(question_numbers):
+    return sorted(question_numbers) == list(range(1, len(question_numbers) + 1))
+
+def pack_answers(answer_numbers, mark_results):
+    # Trả về (packed_answers, correct_bitmap, blank_bitmap)
+    answers = np.asarray(answer_numbers, dtype=np.int16).reshape(-1)
+    blanks = answers == BLANK_NUMBER
+    padded = np.zeros(-(-len(answers) // 4) * 4, dtype=np.uint8)
+    padded[:len(answers)] = np.where(blanks, 0, answers)
+    quads = padded.reshape(-1, 4)
+    packed = (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+    bitmap = np.packbits(np.asarray(mark_results, dtype=bool))
+    return packed.tobytes(), bitmap.tobytes(), np.packbits(blanks).tobytes()
+
+def unpack_answers(packed_answers, correct_bitmap, count, blank_bitmap=None):
+    # Trả về (answer_numbers, mark_results) dạng mảng NumPy độ dài `count`, câu bỏ trống là BLANK_NUMBER
+    packed = np.frombuffer(bytes(packed_answers), dtype=np.uint8)
+    answers = np.stack([(packed >> 6) & 3, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3], axis=1).reshape(-1)[:count].astype(np.int16)
+    marks = np.unpackbits(np.frombuffer(bytes(correct_bitmap), dtype=np.uint8), count=count).astype(bool)
+    if blank_bitmap is not None:
+        answers[np.unpackbits(np.frombuffer(bytes(blank_bitmap), dtype=np.uint8), count=count).astype(bool)] = BLANK_NUMBER
+    return answers, marks
+
+def has_packed_answers(record):
+    return record.packed_answers is not None and record.question_count is not None
+
+def record_answers(record):
+    # (answer_numbers, mark_results) của bản ghi đã lưu gọn
+    return unpack_answers(record.packed_answers, record.correct_bitmap, record.question_count, record.blank_bitmap)
+
+def record_details(record):
+    answers, marks = record_answers(record)
+    return [
+        {'question_number': i + 1, 'answer_number': answer, 'mark_result': mark}
+        for i, (answer, mark) in enumerate(zip(answers.tolist(), marks.tolist()))
+    ]
+
+def record_correct_count(record):
+    return int(np.unpackbits(np.frombuffer(bytes(record.correct_bitmap), dtype=np.uint8), count=record.question_count).sum())
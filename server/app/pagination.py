@@ -0,0 +1,8 @@
+from rest_framework.pagination import CursorPagination
+
+class IdCursorPagination(CursorPagination):
+    # Phân trang theo cursor trên id: không dùng OFFSET, thứ tự ổn định khi dữ liệu thay đổi
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
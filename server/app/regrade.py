@@ -0,0 +1,100 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from .models import ExamAnswer, ExamineePaper, ExamineeRecord, ExamPaper
+from .packedAnswer import has_packed_answers, record_answers
+from .grading import BULK_BATCH_SIZE
+from .examStats import invalidate_paper_stats
+from .leaderboard import update_scores
+
+def answer_key(exam_paper, size):
+    # Mảng đáp án đúng theo câu (vị trí i là câu i + 1), -1 nếu câu chưa có đáp án
+    # Dài ít nhất `size` và đủ chứa mọi câu có đáp án (kể cả câu vượt number_of_questions, giống save_exam_result)
+    answers = list(ExamAnswer.objects.filter(exam_paper=exam_paper, question_number__gte=1).values_list('question_number', 'answer_number'))
+    key = np.full(max([size, *(question_number for question_number, _ in answers)]), -1, dtype=np.int16)
+    for question_number, answer_number in answers:
+        key[question_number - 1] = answer_number
+    return key
+
+def mark(answers, question_numbers, key):
+    # Câu đúng: câu có đáp án và trùng với câu trả lời (câu bỏ trống là -1, không bao giờ đúng)
+    index = np.asarray(question_numbers, dtype=np.int64) - 1
+    index[(index < 0) | (index >= len(key))] = len(key)
+    expected = np.append(key, -1)[index]
+    return (np.asarray(answers, dtype=np.int16) == expected) & (expected >= 0)
+
+def compute_score(correct, number_of_questions):
+    # Cùng công thức với save_exam_result
+    return (correct / number_of_questions) * 10 if number_of_questions > 0 else 0
+
+def regrade_exam_paper(exam_paper):
+    """
+    Chấm lại toàn bộ bài làm của `exam_paper` theo đáp án hiện tại (sau khi sửa ExamAnswer / số câu).
+    Bài làm được nạp thành mảng NumPy, chấm 1 lần cho cả đề rồi ghi lại bằng bulk update.
+    Trả về số bản ghi thí sinh và số dòng ExamineePaper đã thay đổi.
+    """
+    with transaction.atomic():
+        exam_paper = ExamPaper.objects.select_for_update().get(pk=exam_paper.pk)
+        number_of_questions = exam_paper.number_of_questions
+
+        # Bài làm dạng dòng (ExamineePaper): id, examinee, câu, câu trả lời, kết quả cũ
+        rows = np.array(
+            list(
+                ExamineePaper.objects
+                .filter(exam_paper=exam_paper)
+                .order_by('pk')
+                .values_list('id', 'examinee_id', 'question_number', 'answer_number', 'mark_result')
+            ),
+            dtype=np.int64
+        ).reshape(-1, 5)
+
+        # Bản ghi thí sinh làm đề này: exam_paper trỏ tới đề, hoặc bản ghi cũ có dòng ExamineePaper của đề
+        records = list(ExamineeRecord.objects.filter(
+            Q(exam_paper=exam_paper) | Q(exam_paper__isnull=True, examinee_id__in=set(rows[:, 1].tolist())),
+            exam_id=exam_paper.exam_id,
+        ))
+
+        # Đáp án đủ dài cho mọi câu trong bài làm dạng dòng và dạng gọn
+        max_question = max([
+            number_of_questions,
+            int(rows[:, 2].max()) if len(rows) else 0,
+            *(rec.question_count for rec in records if has_packed_answers(rec)),
+        ])
+        key = answer_key(exam_paper, max_question)
+
+        new_marks = mark(rows[:, 3], rows[:, 2], key)
+        changed = new_marks != rows[:, 4].astype(bool)
+        for value in (True, False):
+            ids = rows[changed & (new_marks == value), 0].tolist()
+            for start in range(0, len(ids), BULK_BATCH_SIZE):
+                ExamineePaper.objects.filter(id__in=ids[start:start + BULK_BATCH_SIZE]).update(mark_result=value)
+
+        # Số câu đúng của từng thí sinh, mỗi câu tính theo dòng đầu tiên (giống save_exam_result)
+        _, first = np.unique(rows[:, 1:3], axis=0, return_index=True)
+        examinee_ids, counts = np.unique(rows[first, 1][new_marks[first]], return_counts=True)
+        row_correct = dict(zip(examinee_ids.tolist(), counts.tolist()))
+
+        to_update = []
+        for rec in records:
+            dirty = False
+            if has_packed_answers(rec):
+                answers, old_marks = record_answers(rec)
+                marks = mark(answers, np.arange(1, rec.question_count + 1), key)
+                if (marks != old_marks).any():
+                    rec.correct_bitmap = np.packbits(marks).tobytes()
+                    dirty = True
+                correct = int(marks.sum())
+            else:
+                correct = row_correct.get(rec.examinee_id, 0)
+            score = compute_score(correct, number_of_questions)
+            if rec.score != score:
+                rec.score = score
+                dirty = True
+            if dirty:
+                to_update.append(rec)
+        ExamineeRecord.objects.bulk_update(to_update, ['score', 'correct_bitmap'], batch_size=BULK_BATCH_SIZE)
+        transaction.on_commit(lambda: invalidate_paper_stats(exam_paper.id))
+        scores = {rec.examinee_id: rec.score for rec in to_update}
+        transaction.on_commit(lambda: update_scores(exam_paper.exam_id, scores))
+
+    return {"records": len(to_update), "rows": int(changed.sum())}
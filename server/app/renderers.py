@@ -0,0 +1,23 @@
+import json
+from rest_framework import renderers
+
+# Document: https://www.django-rest-framework.org/api-guide/renderers/#custom-renderers
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    # Cho phép client gửi `Accept: text/event-stream` (Server-Sent Events)
+    # Response stream tự sinh dữ liệu, renderer chỉ dùng cho response lỗi
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode(self.charset)
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    # Cho phép client gửi `Accept: application/x-ndjson` (mỗi dòng 1 object JSON)
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data) + "\n").encode(self.charset)
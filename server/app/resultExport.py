@@ -0,0 +1,58 @@
+from .models import ExamineePaper, ExamineeRecord, ExamPaper
+from .packedAnswer import has_packed_answers, record_answers
+from .serializers import annotate_result_paper
+
+EXPORT_CHUNK_SIZE = 1000
+
+def answer_letter(answer_number):
+    return "ABCD"[answer_number] if 0 <= answer_number < 4 else ''
+
+def export_columns(exam):
+    # Số cột câu hỏi = số câu lớn nhất trong các đề của kỳ thi
+    questions = max(ExamPaper.objects.filter(exam=exam).values_list('number_of_questions', flat=True), default=0)
+    return questions, ['student_ID', 'name', 'exam_paper_code', 'score'] + [f"Q{i}" for i in range(1, questions + 1)]
+
+def export_rows(exam):
+    """
+    Kết quả của kỳ thi `exam`: dòng tiêu đề rồi 1 dòng / thí sinh (SBD, tên, mã đề, điểm, đáp án từng câu).
+    Đọc bản ghi theo chunk EXPORT_CHUNK_SIZE theo khoá (id > id cuối của chunk trước), không dùng iterator()
+    vì MySQL không có server-side cursor và sẽ nạp hết kết quả. Bài làm cũ trong ExamineePaper lấy 1 query / chunk.
+    Bộ nhớ chỉ phụ thuộc kích thước chunk, không phụ thuộc số thí sinh.
+    """
+    questions, header = export_columns(exam)
+    yield header
+
+    records = annotate_result_paper(
+        ExamineeRecord.objects
+        .filter(exam=exam)
+        .select_related('examinee')
+        .order_by('id')
+    )
+    last_id = 0
+    while True:
+        chunk = list(records.filter(id__gt=last_id)[:EXPORT_CHUNK_SIZE])
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+        legacy = [rec for rec in chunk if not has_packed_answers(rec) and rec.result_paper_id]
+        rows = {}
+        if legacy:
+            for examinee_id, exam_paper_id, question_number, answer_number in (
+                ExamineePaper.objects
+                .filter(examinee_id__in={rec.examinee_id for rec in legacy}, exam_paper_id__in={rec.result_paper_id for rec in legacy})
+                .order_by('pk')
+                .values_list('examinee_id', 'exam_paper_id', 'question_number', 'answer_number')
+            ):
+                rows.setdefault((examinee_id, exam_paper_id), {}).setdefault(question_number, answer_number)
+
+        for rec in chunk:
+            if has_packed_answers(rec):
+                answers = {i + 1: answer for i, answer in enumerate(record_answers(rec)[0].tolist())}
+            else:
+                answers = rows.get((rec.examinee_id, rec.result_paper_id), {})
+            yield [
+                rec.examinee.student_ID,
+                rec.examinee.name,
+                rec.result_paper_code or '',
+                rec.score if rec.score is not None else '',
+            ] + [answer_letter(answers[q]) if q in answers else '' for q in range(1, questions + 1)]
@@ -1,4 +1,5 @@
 import boto3
+import threading
 from pathlib import Path
 from botocore.config import Config
 from botocore.exceptions import ClientError
@@ -82,4 +83,31 @@ def get_object_presigned_url(bucket, key, expiration_seconds, b2):
     except ClientError as ce:
         print('error', ce)
 
+_local = threading.local()
+
+def get_presign_client():
+    # Mỗi thread 1 client riêng (boto3 session không thread-safe), tạo 1 lần và dùng lại
+    client = getattr(_local, 'client', None)
+    if client is None:
+        client = boto3.session.Session().client(service_name='s3',
+                                                endpoint_url=ENDPOINT,
+                                                aws_access_key_id=KEY_ID,
+                                                aws_secret_access_key=APPLICATION_KEY,
+                                                config=Config(signature_version='s3v4'))
+        _local.client = client
+    return client
+
+def get_object_presigned_urls(bucket, keys, expiration_seconds):
+    # Ký URL cho nhiều key, trả về {key: url}; việc ký chạy cục bộ, không gọi mạng
+    client = get_presign_client()
+    urls = {}
+    for key in keys:
+        try:
+            urls[key] = client.generate_presigned_url(ClientMethod='get_object',
+                                                      ExpiresIn=expiration_seconds,
+                                                      Params={'Bucket': bucket, 'Key': key})
+        except ClientError as ce:
+            print('error', ce)
+    return urls
+
 b2 = get_b2_resource(ENDPOINT, KEY_ID, APPLICATION_KEY)
\ No newline at end of file
@@ -1,6 +1,12 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueTogetherValidator
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.manager import BaseManager
 from .models import *
-from .tasks import get_image_url
+from .tasks import get_image_url, get_image_urls
+from .packedAnswer import has_packed_answers, record_details, record_correct_count
+from .grading import ANSWER_CHOICES, BLANK_ANSWER
 
 class UserRegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -23,8 +29,68 @@ class UserSerializer(serializers.ModelSerializer):
         model = CustomUser
         fields = ('username', 'email', 'isVerificated')
     
-class ExamSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    # GET ?fields=id,name: chỉ trả về các trường được chọn
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        fields = request.query_params.get('fields') if request and request.method == 'GET' else None
+        if fields:
+            selected = {name.strip() for name in fields.split(',')}
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+class UrlKwargDefault:
+    # Giá trị mặc định lấy từ URL của view (vd. exam_pk của route lồng nhau), để validator unique kiểm tra được
+    requires_context = True
+
+    def __init__(self, kwarg):
+        self.kwarg = kwarg
+
+    def __call__(self, serializer_field):
+        view = serializer_field.context.get('view')
+        return view.kwargs.get(self.kwarg) if view else None
+
+def count_subquery(queryset, field):
+    # Subquery đếm số dòng của `queryset` theo `field` (dùng với OuterRef)
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(n=Count('id')).values('n'),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+def annotate_exam_counts(queryset):
+    # Số đề, số bản ghi thí sinh, số bản ghi đã chấm / chưa chấm của mỗi kỳ thi
+    records = ExamineeRecord.objects.filter(exam=OuterRef('pk'))
+    return queryset.annotate(
+        exampaper_count_value=count_subquery(ExamPaper.objects.filter(exam=OuterRef('pk')), 'exam'),
+        examinee_record_count_value=count_subquery(records, 'exam'),
+        graded_count_value=count_subquery(records.filter(score__isnull=False), 'exam'),
+    )
+
+def annotate_result_paper(queryset):
+    # Đề thí sinh đã làm: exam_paper của bản ghi, hoặc đề trong ExamineePaper với bản ghi cũ
+    legacy_paper = (
+        ExamineePaper.objects
+        .filter(examinee=OuterRef('examinee'), exam_paper__exam=OuterRef('exam'))
+        .order_by('pk')
+        .values('exam_paper')[:1]
+    )
+    return (
+        queryset
+        .annotate(result_paper_id=Coalesce(F('exam_paper'), Subquery(legacy_paper), output_field=IntegerField()))
+        .annotate(result_paper_code=Subquery(
+            ExamPaper.objects.filter(pk=OuterRef('result_paper_id')).values('exam_paper_code')[:1]
+        ))
+    )
+
+class ExamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     exampaper_count = serializers.SerializerMethodField()
+    examinee_record_count = serializers.SerializerMethodField()
+    graded_count = serializers.SerializerMethodField()
+    ungraded_count = serializers.SerializerMethodField()
     class Meta: 
         model = Exam
         fields = '__all__'
@@ -32,11 +98,31 @@ class ExamSerializer(serializers.ModelSerializer):
             'user': {'read_only': True}, 
             'exampaper_count': {'read_only': True}
         }
+
+    def get_counts(self, obj):
+        # Đọc từ annotate_exam_counts, nếu không có (vd. sau khi tạo) thì tính lại
+        if not hasattr(obj, 'exampaper_count_value'):
+            counts = annotate_exam_counts(Exam.objects.filter(pk=obj.pk)).values(
+                'exampaper_count_value', 'examinee_record_count_value', 'graded_count_value'
+            ).first() or {}
+            for name in ('exampaper_count_value', 'examinee_record_count_value', 'graded_count_value'):
+                setattr(obj, name, counts.get(name, 0))
+        return obj.exampaper_count_value, obj.examinee_record_count_value, obj.graded_count_value
     
     def get_exampaper_count(self, obj):
-        return ExamPaper.objects.filter(exam=obj).count()
+        return self.get_counts(obj)[0]
+
+    def get_examinee_record_count(self, obj):
+        return self.get_counts(obj)[1]
 
-class ExamPaperSerializer(serializers.ModelSerializer):
+    def get_graded_count(self, obj):
+        return self.get_counts(obj)[2]
+
+    def get_ungraded_count(self, obj):
+        _, records, graded = self.get_counts(obj)
+        return records - graded
+
+class ExamPaperSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta: 
         model = ExamPaper
         fields = '__all__'
@@ -44,21 +130,33 @@ class ExamPaperSerializer(serializers.ModelSerializer):
             'exam': {'read_only': True} 
         }
 
-class ExamAnswerSerializer(serializers.ModelSerializer):
+class ExamAnswerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    exam_paper = serializers.HiddenField(source='exam_paper_id', default=UrlKwargDefault('exam_paper_pk'))
     class Meta:
         model = ExamAnswer
-        fields = ('id', 'question_number', 'answer_number')
+        fields = ('id', 'exam_paper', 'question_number', 'answer_number')
+        validators = [
+            UniqueTogetherValidator(
+                queryset=ExamAnswer.objects.all(),
+                fields=('exam_paper', 'question_number'),
+                message="Câu hỏi đã có đáp án"
+            )
+        ]
+
+class ExamAnswerItemSerializer(serializers.Serializer):
+    question_number = serializers.IntegerField(min_value=1)
+    answer_number = serializers.IntegerField(min_value=0, max_value=3)
 
 class ExamPaperBatchAnswerSerializer(serializers.Serializer):
-    answers = serializers.JSONField()
-    class Meta:
-        model = ExamAnswer
-        fields = '__all__'
-        extra_kwargs = {
-            'exam_paper': {'read_only': True} 
-        }
+    answers = ExamAnswerItemSerializer(many=True, allow_empty=False)
+
+    def validate_answers(self, answers):
+        question_numbers = [ans['question_number'] for ans in answers]
+        if len(question_numbers) != len(set(question_numbers)):
+            raise serializers.ValidationError("question_number bị trùng")
+        return answers
     
-class ExamineeSerializer(serializers.ModelSerializer):
+class ExamineeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Examinee
         fields = '__all__'
@@ -66,6 +164,17 @@ class ExamineeSerializer(serializers.ModelSerializer):
             'user': {'read_only': True} 
         }
 
+class ExamineeImportSerializer(serializers.Serializer):
+    file = serializers.FileField() # CSV / XLSX với các cột student_ID, name, date_of_birth
+    mode = serializers.ChoiceField(choices=('skip', 'update'), default='skip') # Thí sinh đã có: bỏ qua / cập nhật
+    exam = serializers.IntegerField(required=False) # Tạo ExamineeRecord trong kỳ thi này
+
+class ExamineeImportRowSerializer(serializers.ModelSerializer):
+    date_of_birth = serializers.DateField(input_formats=['iso-8601', '%d/%m/%Y'])
+    class Meta:
+        model = Examinee
+        fields = ('student_ID', 'name', 'date_of_birth')
+
 class OTPRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = OTPRequest
@@ -97,29 +206,48 @@ class CameraStreamSerializer(serializers.Serializer):
 class ImageUrlSerializer(serializers.Serializer):
     image_name = serializers.CharField(required=True)
 
-class ExamineeRecordSerializer(serializers.ModelSerializer):
+IMAGE_FIELDS = ('original_image', 'processed_image')
+
+class ExamineeRecordListSerializer(serializers.ListSerializer):
+    # Ký URL ảnh của cả danh sách trong 1 lần
+    def to_representation(self, data):
+        records = list(data.all() if isinstance(data, BaseManager) else data)
+        names = [name for name in IMAGE_FIELDS if name in self.child.fields]
+        self.child.image_urls = get_image_urls([getattr(rec, name) for rec in records for name in names])
+        try:
+            return [self.child.to_representation(rec) for rec in records]
+        finally:
+            self.child.image_urls = None
+
+class ExamineeRecordSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    exam = serializers.PrimaryKeyRelatedField(read_only=True, default=UrlKwargDefault('exam_pk'))
     original_image = serializers.CharField(read_only=True) 
     processed_image = serializers.CharField(read_only=True) 
+    image_urls = None
     class Meta:
         model = ExamineeRecord
-        fields = '__all__'
+        list_serializer_class = ExamineeRecordListSerializer
+        exclude = ('packed_answers', 'correct_bitmap', 'blank_bitmap', 'question_count')
+        validators = [
+            UniqueTogetherValidator(
+                queryset=ExamineeRecord.objects.all(),
+                fields=('exam', 'examinee'),
+                message="Thí sinh đã có bản ghi trong kỳ thi này"
+            )
+        ]
         extra_kwargs = {
-            'exam': {'read_only': True}, 
+            'exam_paper': {'read_only': True},
             'original_image': {'read_only': True},
             'processed_image': {'read_only': True}
         }
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        raw = instance.original_image
-
-        data["original_image"] = (
-            get_image_url(raw) if raw else None
-        )
-        processed = instance.processed_image
-        data["processed_image"] = (
-            get_image_url(processed) if processed else None
-        )
+        # Chỉ ký URL cho các trường ảnh được trả về (xem SparseFieldsMixin)
+        names = [name for name in IMAGE_FIELDS if name in data]
+        urls = self.image_urls if self.image_urls is not None else get_image_urls([getattr(instance, name) for name in names])
+        for name in names:
+            data[name] = urls.get(getattr(instance, name))
         return data
         
 class ExamineeRecordDetailSerializer(serializers.ModelSerializer):
@@ -132,25 +260,31 @@ class ExamineeRecordDetailSerializer(serializers.ModelSerializer):
         fields = ('examinee_id', 'examinee_name', 'records')
 
     def get_records(self, obj):
+        # Bài làm cũ (chưa lưu gọn) của thí sinh trong kỳ thi của bản ghi
+        legacy_rows = ExamineePaper.objects.filter(examinee=OuterRef('examinee'), exam_paper__exam=OuterRef('exam'))
         record_qs = (
             ExamineeRecord.objects
             .filter(examinee=obj)
-            .select_related('exam')
+            .select_related('exam', 'exam_paper')
+            .annotate(
+                legacy_paper_id=Subquery(legacy_rows.order_by('pk').values('exam_paper')[:1]),
+                legacy_correct=count_subquery(legacy_rows.filter(mark_result=True), 'examinee'),
+            )
         )
+        records = list(record_qs)
+
+        # Đề thi của các bản ghi cũ và URL ảnh: mỗi loại lấy 1 lần cho cả danh sách
+        legacy_paper_ids = {rec.legacy_paper_id for rec in records if rec.exam_paper is None and rec.legacy_paper_id}
+        legacy_papers = ExamPaper.objects.in_bulk(legacy_paper_ids) if legacy_paper_ids else {}
+        urls = get_image_urls([key for rec in records for key in (rec.original_image, rec.processed_image)])
 
         out = []
 
-        for rec in record_qs:
+        for rec in records:
             exam = rec.exam 
 
-            ep_qs = (
-                ExamineePaper.objects
-                .filter(examinee=obj, exam_paper__exam=exam)
-                .select_related('exam_paper')
-            )
-
-            exam_paper = ep_qs.first().exam_paper if ep_qs.exists() else None
-            correct_answers = ep_qs.filter(mark_result=True).count()
+            exam_paper = rec.exam_paper or legacy_papers.get(rec.legacy_paper_id)
+            correct_answers = record_correct_count(rec) if has_packed_answers(rec) else rec.legacy_correct
 
             exam_dict = {
                 "exam_id": exam.id,
@@ -165,8 +299,8 @@ class ExamineeRecordDetailSerializer(serializers.ModelSerializer):
                 "result": {
                     "correct_answers": correct_answers,
                     "score": rec.score,
-                    "original_image": get_image_url(rec.original_image) if rec.original_image else None,
-                    "processed_image": get_image_url(rec.processed_image) if rec.processed_image else None,
+                    "original_image": urls.get(rec.original_image),
+                    "processed_image": urls.get(rec.processed_image),
                 }
             }
 
@@ -188,6 +322,39 @@ class ImageProcessSerializer(serializers.ModelSerializer):
         model = ExamineeRecord
         fields = ('image',)
 
+class ImageProcessBatchSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False) # File ZIP chứa ảnh
+
+    def validate(self, attrs):
+        if not attrs.get('images') and not attrs.get('archive'):
+            raise serializers.ValidationError("Cần gửi `images` hoặc `archive` (ZIP)")
+        return attrs
+
+class ImageProcessGradeSerializer(serializers.Serializer):
+    exam = serializers.IntegerField()
+    image = serializers.ImageField(write_only=True, required=True)
+
+class ScanResultSerializer(serializers.Serializer):
+    # Kết quả đọc 1 tờ bài, chỉ gửi các trường cần sửa; answers: {"1": "A", ...}, "?" là bỏ trống
+    sbd = serializers.CharField(max_length=6, required=False)
+    made = serializers.CharField(max_length=6, required=False)
+    answers = serializers.DictField(child=serializers.ChoiceField(choices=(*ANSWER_CHOICES, BLANK_ANSWER)), required=False)
+
+    def validate_answers(self, answers):
+        out = {}
+        for key, answer in answers.items():
+            if not (key.isascii() and key.isdigit()) or int(key) < 1:
+                raise serializers.ValidationError(f"Số câu không hợp lệ: {key}")
+            if str(int(key)) in out:
+                raise serializers.ValidationError(f"Số câu bị trùng: {key}")
+            out[str(int(key))] = answer
+        return out
+
+class ImageProcessCorrectSerializer(serializers.Serializer):
+    exam = serializers.IntegerField()
+    result = ScanResultSerializer() # Các trường cần sửa: sbd, made, answers
+
 class ImageProcessSaveSerializer(serializers.Serializer):
     result = serializers.JSONField()
     class Meta:
@@ -205,20 +372,33 @@ class ExamineeResultSerializer(serializers.ModelSerializer):
         }
     
     def get_result(self, obj):
-        exam_results = ExamineePaper.objects.filter(examinee=obj.examinee, exam_paper__exam=obj.exam)
-        results_list = []
-        for er in exam_results:
-            results_list.append({
-                'question_number': er.question_number,
-                'answer_number': er.answer_number,
-                'mark_result': er.mark_result
-            })
-        
+        if has_packed_answers(obj):
+            details = record_details(obj)
+            return {
+                'exam_paper_code': obj.exam_paper.exam_paper_code if obj.exam_paper else None,
+                'total_questions': len(details),
+                'correct_answers': record_correct_count(obj),
+                'score': obj.score,
+                'details': details
+            }
+
+        # Bài làm cũ: đọc theo đề thí sinh đã làm (`result_paper_id`, xem ExamineeResultViewSet)
+        paper_id = getattr(obj, 'result_paper_id', obj.exam_paper_id)
+        exam_results = ExamineePaper.objects.filter(examinee_id=obj.examinee_id, exam_paper_id=paper_id)
+        totals = exam_results.aggregate(total=Count('id'), correct=Count('id', filter=Q(mark_result=True)))
+        # Danh sách thường: JSONEncoder của DRF cũng gom generator thành tuple, 1 bài chỉ có vài trăm câu
+        details = [
+            {'question_number': question_number, 'answer_number': answer_number, 'mark_result': mark_result}
+            for question_number, answer_number, mark_result in (
+                exam_results.order_by('question_number').values_list('question_number', 'answer_number', 'mark_result')
+            )
+        ]
+
         result = {
-            'exam_paper_code': obj.exam.exampaper_set.filter(exam=obj.exam).first().exam_paper_code if obj.exam.exampaper_set.filter(exam=obj.exam).exists() else None,
-            'total_questions': exam_results.count(),
-            'correct_answers': exam_results.filter(mark_result=True).count(),
+            'exam_paper_code': getattr(obj, 'result_paper_code', obj.exam_paper.exam_paper_code if obj.exam_paper else None),
+            'total_questions': totals['total'],
+            'correct_answers': totals['correct'],
             'score': obj.score,
-            'details': results_list
+            'details': details
         }
-        return result
\ No newline at end of file
+        return result
@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import ExamineeRecord, ExamPaper
+from .examStats import invalidate_paper_stats, record_sheet, remove_record_stats
+from .leaderboard import update_score
+
+# Cập nhật cache khi xoá, kể cả khi xoá theo cascade (xoá thí sinh, kỳ thi, đề thi)
+
+@receiver(post_delete, sender=ExamineeRecord)
+def examinee_record_deleted(sender, instance, **kwargs):
+    sheet = record_sheet(instance)
+    graded = instance.score is not None
+    transaction.on_commit(lambda: remove_record_stats(instance.exam_id, sheet, graded))
+    transaction.on_commit(lambda: update_score(instance.exam_id, instance.examinee_id, None))
+
+@receiver(post_delete, sender=ExamPaper)
+def exam_paper_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_paper_stats(instance.id))
@@ -0,0 +1,85 @@
+import codecs
+import csv
+import tempfile
+
+# Đọc / ghi bảng tính CSV, XLSX theo dòng (không nạp cả file vào bộ nhớ).
+# XLSX cần openpyxl; thiếu thì chỉ hỗ trợ CSV.
+
+class SpreadsheetError(ValueError):
+    pass
+
+def file_type_of(name):
+    name = (name or '').lower()
+    if name.endswith('.xlsx'):
+        return 'xlsx'
+    if name.endswith('.csv'):
+        return 'csv'
+    raise SpreadsheetError("Chỉ hỗ trợ file .csv hoặc .xlsx")
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def load_openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise SpreadsheetError("Server chưa cài openpyxl, không đọc / ghi được XLSX")
+    return openpyxl
+
+def read_rows(file):
+    """
+    Đọc `file` (UploadedFile) theo từng dòng, dòng đầu là tiêu đề.
+    Trả về (tiêu đề, generator (số dòng trong file, {tiêu đề: giá trị})), bỏ qua dòng trống.
+    """
+    if file_type_of(file.name) == 'xlsx':
+        openpyxl = load_openpyxl()
+        try:
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        except Exception:
+            raise SpreadsheetError("File XLSX không hợp lệ")
+        rows = workbook.active.iter_rows(values_only=True)
+    else:
+        rows = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+
+    header = next(rows, None)
+    if not header:
+        raise SpreadsheetError("File rỗng")
+    header = [str(h).strip() if h is not None else '' for h in header]
+
+    def generate():
+        for line, values in enumerate(rows, start=2):
+            if not any(v not in (None, '') for v in values):
+                continue
+            yield line, dict(zip(header, values))
+    return header, generate()
+
+class Echo:
+    # File giả cho csv.writer: trả lại chuỗi vừa ghi để stream
+    def write(self, value):
+        return value
+
+def stream_csv(rows):
+    # Mỗi dòng (list) -> 1 chunk CSV; BOM để Excel đọc đúng UTF-8
+    writer = csv.writer(Echo())
+    yield '\ufeff'
+    for row in rows:
+        yield writer.writerow(row)
+
+def write_xlsx(rows, title='Sheet'):
+    # Ghi XLSX ở chế độ write_only ra file tạm (không giữ cả bảng trong bộ nhớ), trả về file đã ghi
+    openpyxl = load_openpyxl()
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    for row in rows:
+        sheet.append(row)
+    out = tempfile.TemporaryFile()
+    workbook.save(out)
+    out.seek(0)
+    return out
@@ -1,5 +1,6 @@
 import io
 from celery import shared_task
+from celery.exceptions import TimeoutError as InferenceTimeoutError
 from email.mime.text import MIMEText
 from email.utils import formataddr
 from smtplib import SMTP
@@ -8,7 +9,11 @@ import environ
 from app import s3Image, randomX
 import os
 import base64
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
 from AI.ai import No_Le_AI
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -17,7 +22,7 @@ environ.Env.read_env(BASE_DIR / ".env")
 
 # Document for send email: https://mailtrap.io/blog/python-send-email/
 
-@shared_task
+@shared_task(ignore_result=True)
 def send_otp(receiver, otp_code):
     subject = 'Mã OTP của bạn từ TestMarkDB'
     body = f"""
@@ -114,8 +119,28 @@ def upload_image(file):
     s3Image.upload_objfile(b2=s3Image.b2, bucket=s3Image.BUCKET_NAME, fileobj=file)
     return file.name
 
+def key_image_url(key) -> str:
+    return f"imgurl:{{{key}}}"
+
 def get_image_url(key):
-    return s3Image.get_object_presigned_url(bucket=s3Image.BUCKET_NAME, key=key, b2=s3Image.b2, expiration_seconds=60)
+    return get_image_urls([key]).get(key)
+
+def get_image_urls(keys):
+    """
+    {key: url} cho nhiều ảnh (bỏ qua key rỗng và key trùng).
+    URL đã ký được cache trong nửa đầu thời hạn, nên URL trả về luôn còn hạn ít nhất IMAGE_URL_EXPIRES / 2 giây.
+    """
+    keys = {key for key in keys if key}
+    if not keys:
+        return {}
+    cached = cache.get_many([key_image_url(key) for key in keys])
+    urls = {key: cached[key_image_url(key)] for key in keys if key_image_url(key) in cached}
+    missing = keys - urls.keys()
+    if missing:
+        signed = s3Image.get_object_presigned_urls(bucket=s3Image.BUCKET_NAME, keys=missing, expiration_seconds=settings.IMAGE_URL_EXPIRES)
+        cache.set_many({key_image_url(key): url for key, url in signed.items()}, timeout=settings.IMAGE_URL_EXPIRES // 2)
+        urls.update(signed)
+    return urls
 
 def key_value_data(id) -> str: 
     return f"img:{{{id}}}:data"
@@ -135,24 +160,124 @@ def update_camera_stream(id, data, ts):
 def download_file(local_name, key_name):
     s3Image.download_file(b2=s3Image.b2, bucket=s3Image.BUCKET_NAME, directory=str(s3Image.BASE_DIR / "temporary"), local_name=local_name, key_name=key_name)
 
-def remove_temporary_file(local_name):
-    file_path = s3Image.BASE_DIR / "temporary" / local_name
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-OUT_IMAGE_PATH = s3Image.BASE_DIR / "AI" / "out" / "after.jpg"
-def process_image(local_name):
+def process_scan(data, progress=None):
+    # Chạy pipeline AI, trả về kết quả kèm ảnh đã xử lý (base64) hoặc None
     ai = No_Le_AI()
-    input_path = s3Image.BASE_DIR / "temporary" / local_name
-    result = ai.process(str(input_path))
+    result, processed_image = ai.process(data, progress=progress)
+    if not result:
+        return None
 
-    with open(input_path, "rb") as f:
-        result['original_image'] = base64.b64encode(f.read()).decode('utf-8')
-        result['original_image_name'] = local_name
+    result['processed_image'] = base64.b64encode(processed_image).decode('utf-8')
+    result['processed_image_name'] = "processed_image.jpg"
+    return result
 
-    with open(OUT_IMAGE_PATH, "rb") as f:
-        result['processed_image'] = base64.b64encode(f.read()).decode('utf-8')
-        result['processed_image_name'] = "processed_image.jpg"
+@shared_task(bind=True)
+def run_inference(self, image_b64, image_name=None):
+    # Chạy trên inference worker (queue `inference`), model đã được tải sẵn trong mỗi process
+    # Có `image_name` (job bất đồng bộ) thì kèm luôn ảnh gốc vào kết quả
+    def progress(stage):
+        self.update_state(state='PROGRESS', meta={'stage': stage})
 
-    remove_temporary_file(local_name)
+    result = process_scan(base64.b64decode(image_b64), progress=progress)
+    if result and image_name:
+        result['original_image'] = image_b64
+        result['original_image_name'] = image_name
     return result
+
+class InferenceUnavailable(APIException):
+    # Inference worker không trả kết quả kịp (không có worker hoặc queue đang chậm)
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Hệ thống xử lý ảnh đang bận, vui lòng thử lại sau"
+
+def scan_image(data):
+    # Xử lý ảnh trong bộ nhớ (local hoặc qua inference worker), kết quả kèm ảnh đã xử lý dạng base64
+    # Trả về None nếu xử lý thất bại, raise InferenceUnavailable nếu quá INFERENCE_TIMEOUT
+    if settings.INFERENCE_MODE == 'queue':
+        image_b64 = base64.b64encode(data).decode('utf-8')
+        try:
+            return run_inference.delay(image_b64).get(timeout=settings.INFERENCE_TIMEOUT)
+        except InferenceTimeoutError:
+            raise InferenceUnavailable()
+        except Exception as e:
+            print('error', e)
+            return None
+    return process_scan(data)
+
+def process_image(data, image_name):
+    # Xử lý ảnh trong bộ nhớ, không ghi file tạm
+    result = scan_image(data)
+    if not result:
+        return None
+
+    result['original_image'] = base64.b64encode(data).decode('utf-8')
+    result['original_image_name'] = image_name
+    return result
+
+DEFAULT_QUEUE = 'celery' # Queue của worker `celery` (entrypoint.sh RUN_CELERY)
+
+def key_job_owner(id) -> str:
+    return f"job:{{{id}}}:user"
+
+def submit_inference(data, image_name, user_id):
+    # Tạo job xử lý ảnh, trạng thái và kết quả được lưu ở result backend (Redis)
+    # Luôn chạy nền: queue `inference` hoặc (INFERENCE_MODE=local) queue mặc định của worker `celery`
+    args = (base64.b64encode(data).decode('utf-8'), image_name)
+    if settings.INFERENCE_MODE == 'queue':
+        job = run_inference.apply_async(args=args)
+    else:
+        job = run_inference.apply_async(args=args, queue=DEFAULT_QUEUE)
+    cache.set(key_job_owner(job.id), user_id, timeout=int(settings.CELERY_RESULT_EXPIRES.total_seconds()))
+    return job.id
+
+def get_job_owner(job_id):
+    return cache.get(key_job_owner(job_id))
+
+def get_inference_job(job_id):
+    job = run_inference.AsyncResult(job_id)
+    data = {"job_id": job_id, "status": job.state}
+    if job.state == 'PROGRESS':
+        data["stage"] = (job.info or {}).get('stage')
+    elif job.successful():
+        if job.result:
+            data["result"] = job.result
+        else:
+            data["status"] = 'FAILURE'
+            data["detail"] = "Xử lý hình ảnh thất bại"
+    elif job.failed():
+        data["detail"] = "Xử lý hình ảnh thất bại"
+    return data
+
+SCAN_TIMEOUT = 24 * 60 * 60 # Bản scan được giữ 1 ngày để sửa kết quả theo scan_id
+
+def key_scan(id) -> str:
+    return f"scan:{{{id}}}"
+
+def save_scan(user_id, result, original_image, processed_image):
+    # Lưu kết quả đọc và key ảnh trên S3 của 1 bản scan
+    scan_id = ''.join(randomX.base62[x] for x in randomX.randomX(24, 0, 62))
+    scan = {
+        "user": user_id,
+        "result": result,
+        "original_image": original_image,
+        "processed_image": processed_image,
+    }
+    update_scan(scan_id, scan)
+    return scan_id, scan
+
+def get_scan(scan_id):
+    return cache.get(key_scan(scan_id))
+
+def update_scan(scan_id, scan):
+    cache.set(key_scan(scan_id), scan, timeout=SCAN_TIMEOUT)
+
+@shared_task(ignore_result=True)
+def regrade_paper(exam_paper_id):
+    from .models import ExamPaper
+    from .regrade import regrade_exam_paper
+    exam_paper = ExamPaper.objects.filter(pk=exam_paper_id).first()
+    if exam_paper:
+        regrade_exam_paper(exam_paper)
+
+def schedule_regrade(exam_paper_id):
+    # Chấm lại sau khi transaction lưu đáp án / đề thi đã commit
+    transaction.on_commit(lambda: regrade_paper.delay(exam_paper_id))
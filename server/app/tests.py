@@ -1,3 +1,268 @@
-from django.test import TestCase
+import datetime
+import io
+import zipfile
+from unittest import mock
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework import serializers, status
+from rest_framework.test import APIClient
+from .models import *
+from . import examineeImport
+from .grading import find_grading_target, save_exam_answers, save_exam_result
+from .regrade import regrade_exam_paper
+from .views import BATCH_MAX_IMAGES, ImageProcessBatchView
 
-# Create your tests here.
+class GradingDataMixin:
+    # Dữ liệu mẫu: 1 kỳ thi, 1 đề NUMBER_OF_QUESTIONS câu (đáp án câu q là q % 4), các thí sinh 000001, 000002...
+    NUMBER_OF_QUESTIONS = 20
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='teacher', email='teacher@example.com', password='password', isVerificated=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.exam = self.create_exam()
+        self.exam_paper = self.create_exam_paper(self.exam)
+
+    def create_exam(self, name='Exam'):
+        return Exam.objects.create(user=self.user, name=name, exam_date=datetime.date(2025, 1, 1))
+
+    def create_exam_paper(self, exam, code='001'):
+        exam_paper = ExamPaper.objects.create(exam=exam, exam_paper_code=code, number_of_questions=self.NUMBER_OF_QUESTIONS)
+        ExamAnswer.objects.bulk_create([
+            ExamAnswer(exam_paper=exam_paper, question_number=q, answer_number=q % 4)
+            for q in range(1, self.NUMBER_OF_QUESTIONS + 1)
+        ])
+        return exam_paper
+
+    def create_examinee(self, i):
+        return Examinee.objects.create(user=self.user, student_ID=f"{i:06d}", name=f"Examinee {i}", date_of_birth=datetime.date(2008, 1, 1))
+
+class GradingConstraintTests(GradingDataMixin, TestCase):
+    def assertUsesIndex(self, queryset, *names):
+        plan = queryset.explain().lower()
+        self.assertTrue(any(name in plan for name in names), plan)
+
+    def test_hot_lookups_use_indexes(self):
+        # Tên ràng buộc / index (MySQL, PostgreSQL) hoặc index tự tạo cho ràng buộc unique (SQLite)
+        self.assertUsesIndex(
+            ExamAnswer.objects.filter(exam_paper=self.exam_paper, question_number=1),
+            'unique_exam_answer_per_question', 'sqlite_autoindex_app_examanswer',
+        )
+        self.assertUsesIndex(
+            ExamineePaper.objects.filter(exam_paper=self.exam_paper, examinee_id=1, question_number=1),
+            'unique_examinee_paper_question', 'sqlite_autoindex_app_examineepaper',
+        )
+        self.assertUsesIndex(
+            ExamineePaper.objects.filter(examinee_id=1, exam_paper__exam=self.exam),
+            'examineepaper_examinee_paper', 'unique_examinee_paper_question', 'sqlite_autoindex_app_examineepaper',
+        )
+        self.assertUsesIndex(
+            ExamineeRecord.objects.filter(exam=self.exam, examinee_id=1),
+            'unique_examinee_record_per_exam', 'sqlite_autoindex_app_examineerecord',
+        )
+
+    def test_find_grading_target_queries(self):
+        examinee = self.create_examinee(1)
+        record = ExamineeRecord.objects.create(exam=self.exam, examinee=examinee)
+        with self.assertNumQueries(3):
+            target = find_grading_target(self.user, self.exam, {"sbd": "000001", "made": "001"})
+        self.assertEqual(target, (examinee, record, self.exam_paper))
+
+    def test_save_exam_answers_queries(self):
+        # Số query không phụ thuộc số đáp án
+        answers = [{"question_number": q, "answer_number": (q + 1) % 4} for q in range(1, self.NUMBER_OF_QUESTIONS + 1)]
+        with self.assertNumQueries(4):
+            save_exam_answers(self.exam_paper, answers[:1])
+        with self.assertNumQueries(4):
+            counts = save_exam_answers(self.exam_paper, answers)
+        self.assertEqual(counts, {"created": 0, "updated": self.NUMBER_OF_QUESTIONS - 1, "unchanged": 1})
+
+    def test_constraints_reject_duplicates(self):
+        examinee = self.create_examinee(1)
+        ExamineeRecord.objects.create(exam=self.exam, examinee=examinee)
+        ExamineePaper.objects.create(exam_paper=self.exam_paper, examinee=examinee, question_number=1, answer_number=0, mark_result=False)
+        duplicates = [
+            lambda: ExamAnswer.objects.create(exam_paper=self.exam_paper, question_number=1, answer_number=2),
+            lambda: ExamineePaper.objects.create(exam_paper=self.exam_paper, examinee=examinee, question_number=1, answer_number=1, mark_result=True),
+            lambda: ExamineeRecord.objects.create(exam=self.exam, examinee=examinee),
+        ]
+        for create in duplicates:
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                create()
+
+    def test_duplicate_record_returns_400(self):
+        first, second = self.create_examinee(1), self.create_examinee(2)
+        ExamineeRecord.objects.create(exam=self.exam, examinee=first)
+        record = ExamineeRecord.objects.create(exam=self.exam, examinee=second)
+        url = f'/api/Exams/{self.exam.id}/ExamineeRecords/'
+
+        response = self.client.post(url, {"examinee": first.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f'{url}{record.id}/', {"examinee": first.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Cùng thí sinh ở kỳ thi khác vẫn hợp lệ
+        other_exam = self.create_exam('Other')
+        response = self.client.post(f'/api/Exams/{other_exam.id}/ExamineeRecords/', {"examinee": first.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ExamineeRecord.objects.filter(examinee=first).count(), 2)
+
+    def test_duplicate_answer_returns_400(self):
+        url = f'/api/ExamPapers/{self.exam_paper.id}/Answers/'
+        response = self.client.post(url, {"question_number": 1, "answer_number": 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        answer = ExamAnswer.objects.get(exam_paper=self.exam_paper, question_number=2)
+        response = self.client.patch(f'{url}{answer.id}/', {"question_number": 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f'{url}{answer.id}/', {"answer_number": 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(url, {"question_number": self.NUMBER_OF_QUESTIONS + 1, "answer_number": 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+def fake_presigned_urls(bucket, keys, expiration_seconds):
+    return {key: f"https://s3.example.com/{key}" for key in keys}
+
+@override_settings(CACHES=LOCMEM_CACHES, STORE_EXAMINEE_PAPER_ROWS=False)
+@mock.patch('app.tasks.s3Image.get_object_presigned_urls', side_effect=fake_presigned_urls)
+class ExamineeRecordDetailQueryTests(GradingDataMixin, TestCase):
+    # Examinee + danh sách bản ghi (kèm đề, số câu đúng của bài cũ) + đề của các bài cũ
+    QUERIES = 3
+
+    def setUp(self):
+        super().setUp()
+        cache.clear() # URL ảnh đã ký được cache
+        self.examinee = self.create_examinee(1)
+        # Sai các câu chia hết cho 3
+        self.answers = {str(q): "ABCD"[(q % 4 + (q % 3 == 0)) % 4] for q in range(1, self.NUMBER_OF_QUESTIONS + 1)}
+        self.correct = sum(1 for q in range(1, self.NUMBER_OF_QUESTIONS + 1) if q % 3)
+
+    def add_packed_record(self, i):
+        exam = self.create_exam(f"Packed {i}")
+        exam_paper = self.create_exam_paper(exam)
+        record = ExamineeRecord.objects.create(exam=exam, examinee=self.examinee)
+        save_exam_result(self.examinee, record, exam_paper, self.answers, f"original-{i}.jpg", f"processed-{i}.jpg")
+
+    def add_legacy_record(self, i):
+        # Bài cũ: chưa lưu gọn, exam_paper trống, bài làm nằm trong ExamineePaper
+        exam = self.create_exam(f"Legacy {i}")
+        exam_paper = self.create_exam_paper(exam, '002')
+        ExamineeRecord.objects.create(exam=exam, examinee=self.examinee, score=5, original_image=f"legacy-{i}.jpg")
+        ExamineePaper.objects.bulk_create([
+            ExamineePaper(exam_paper=exam_paper, examinee=self.examinee, question_number=q, answer_number=0, mark_result=q <= 10)
+            for q in range(1, self.NUMBER_OF_QUESTIONS + 1)
+        ])
+
+    def get_records(self, count):
+        with self.assertNumQueries(count):
+            response = self.client.get(f'/api/Examinee/{self.examinee.id}/RecordsDetail/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()["records"]
+
+    def test_single_record(self, sign):
+        self.add_packed_record(0)
+        records = self.get_records(self.QUERIES - 1) # Không có bài cũ thì không cần lấy đề
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["result"]["correct_answers"], self.correct)
+        self.assertEqual(records[0]["result"]["original_image"], "https://s3.example.com/original-0.jpg")
+        self.assertEqual(sign.call_count, 1)
+
+    def test_query_count_does_not_grow_with_records(self, sign):
+        self.add_packed_record(0)
+        self.add_legacy_record(0)
+        self.get_records(self.QUERIES)
+
+        for i in range(1, 6):
+            self.add_packed_record(i)
+            self.add_legacy_record(i)
+        sign.reset_mock()
+        records = self.get_records(self.QUERIES)
+        self.assertEqual(len(records), 12)
+        self.assertEqual(sign.call_count, 1) # URL ảnh của mọi bản ghi được ký trong 1 lần
+
+        for record in records:
+            legacy = record["exam_name"].startswith("Legacy")
+            self.assertEqual(record["exam_paper"]["paper_code"], '002' if legacy else '001')
+            self.assertEqual(record["result"]["correct_answers"], 10 if legacy else self.correct)
+
+class ExamineeImportTests(GradingDataMixin, TestCase):
+    def post_csv(self, content):
+        return self.client.post('/api/Examinees/Import/', {"file": SimpleUploadedFile("examinees.csv", content, content_type="text/csv")})
+
+    def test_import_csv(self):
+        response = self.post_csv("student_ID,name,date_of_birth\n000001,A,2008-01-01\n000002,B,01/02/2008\n".encode('utf-8'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["created"], 2)
+
+    def test_non_utf8_csv_returns_400(self):
+        # File "Unicode text" của Excel (UTF-16): lỗi ngay ở dòng tiêu đề
+        response = self.post_csv("student_ID,name,date_of_birth\n000001,A,2008-01-01\n".encode('utf-16'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Examinee.objects.exists())
+
+    def test_concurrent_import_is_retried(self):
+        # Lần nhập khác đã tạo thí sinh 000001 nên lần ghi chunk đầu tiên bị IntegrityError
+        save_chunk = examineeImport.save_chunk
+        def concurrent_save_chunk(*args):
+            if not Examinee.objects.filter(student_ID="000001").exists():
+                self.create_examinee(1)
+                raise IntegrityError("UNIQUE constraint failed")
+            return save_chunk(*args)
+
+        with mock.patch('app.examineeImport.save_chunk', side_effect=concurrent_save_chunk):
+            response = self.post_csv("student_ID,name,date_of_birth\n000001,A,2008-01-01\n000002,B,2008-01-02\n".encode('utf-8'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.json()["created"], response.json()["skipped"]), (1, 1))
+        self.assertEqual(Examinee.objects.filter(user=self.user).count(), 2)
+
+@override_settings(STORE_EXAMINEE_PAPER_ROWS=False)
+class RegradeTests(GradingDataMixin, TestCase):
+    def test_regrade_matches_save_exam_result(self):
+        # Đáp án cho cả các câu vượt number_of_questions
+        extra = self.NUMBER_OF_QUESTIONS + 2
+        ExamAnswer.objects.bulk_create([
+            ExamAnswer(exam_paper=self.exam_paper, question_number=q, answer_number=q % 4)
+            for q in range(self.NUMBER_OF_QUESTIONS + 1, extra + 1)
+        ])
+        answers = {str(q): "ABCD"[q % 4] for q in range(1, extra + 1)}
+        first, second = self.create_examinee(1), self.create_examinee(2)
+        record = ExamineeRecord.objects.create(exam=self.exam, examinee=first)
+        save_exam_result(first, record, self.exam_paper, answers)
+
+        # Sửa đáp án rồi chấm lại, kết quả phải giống chấm mới từ đầu
+        ExamAnswer.objects.filter(exam_paper=self.exam_paper, question_number__in=[1, extra]).update(answer_number=3)
+        regrade_exam_paper(self.exam_paper)
+        expected = ExamineeRecord.objects.create(exam=self.exam, examinee=second)
+        correct, score = save_exam_result(second, expected, self.exam_paper, answers)
+
+        record.refresh_from_db()
+        self.assertEqual(correct, extra - 2)
+        self.assertEqual(record.score, score)
+        self.assertEqual(bytes(record.correct_bitmap), bytes(expected.correct_bitmap))
+
+class ImageProcessBatchReadTests(TestCase):
+    def make_zip(self, count, size=10):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for i in range(count):
+                zf.writestr(f"sheet-{i}.jpg", b"\0" * size)
+            zf.writestr("notes.txt", "bỏ qua")
+        buffer.seek(0)
+        return buffer
+
+    def test_zip_limits_checked_before_reading(self):
+        view = ImageProcessBatchView()
+        sheets = view.read_sheets([], self.make_zip(3))
+        self.assertEqual([name for name, _, _ in sheets], ["sheet-0.jpg", "sheet-1.jpg", "sheet-2.jpg"])
+
+        with mock.patch.object(zipfile.ZipFile, 'read') as read:
+            with self.assertRaises(serializers.ValidationError):
+                view.read_sheets([], self.make_zip(BATCH_MAX_IMAGES + 1))
+            with mock.patch('app.views.BATCH_MAX_TOTAL_SIZE', 25), self.assertRaises(serializers.ValidationError):
+                view.read_sheets([], self.make_zip(3))
+            read.assert_not_called()
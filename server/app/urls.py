@@ -31,10 +31,22 @@ urlpatterns = [
     path("api/CameraStream/<str:id>/", CameraStreamView.as_view(), name="CameraStream"),
     path("api/CameraStreamImage/<str:id>/", CameraStreamImageView.as_view(), name="CameraStreamImage"),
     path("api/ImageProcess/", ImageProcessView.as_view(), name="ImageProcess"),
+    path("api/ImageProcessBatch/", ImageProcessBatchView.as_view(), name="ImageProcessBatch"),
+    path("api/ImageProcessJobs/", ImageProcessJobView.as_view(), name="ImageProcessJob"),
+    path("api/ImageProcessJobs/<str:job_id>/", ImageProcessJobDetailView.as_view(), name="ImageProcessJobDetail"),
+    path("api/ImageProcessJobs/<str:job_id>/Events/", ImageProcessJobEventsView.as_view(), name="ImageProcessJobEvents"),
+    path("api/ImageProcessGrade/", ImageProcessGradeView.as_view(), name="ImageProcessGrade"),
+    path("api/ImageProcessGrade/<str:scan_id>/", ImageProcessCorrectView.as_view(), name="ImageProcessCorrect"),
     path("api/ImageProcessSave/", ImageProcessSaveView.as_view(), name="ImageProcessSave"),
+    path("api/Examinees/Import/", ExamineeImportView.as_view(), name="ExamineeImport"),
     path("api/Examinee/<int:examinee_id>/RecordsDetail/", ExamineeRecordDetailView.as_view(), name="ExamineeRecordDetail"),
     path("api/ExamineeRecords/<int:examinee_record_pk>/Result/", ExamineeResultViewSet.as_view({'get': 'list'}), name="ExamineeResult"),
     path("api/ExamPapers/<int:exam_paper_pk>/BatchAnswer/", ExamPaperBatchAnswerView.as_view(), name="ExamPaperBatchAnswer"),
+    path("api/Exams/<int:exam_pk>/Statistics/", ExamStatisticsView.as_view(), name="ExamStatistics"),
+    path("api/Exams/<int:exam_pk>/Export/", ExamExportView.as_view(), name="ExamExport"),
+    path("api/Exams/<int:exam_pk>/Leaderboard/", ExamLeaderboardView.as_view(), name="ExamLeaderboard"),
+    path("api/Exams/<int:exam_pk>/Leaderboard/<int:examinee_pk>/", ExamLeaderboardRankView.as_view(), name="ExamLeaderboardRank"),
+    path("api/ExamPapers/<int:exam_paper_pk>/Statistics/", ExamPaperStatisticsView.as_view(), name="ExamPaperStatistics"),
 
     path("api/", include(router.urls)),
     path("api/", include(exam_paper_router.urls)),
@@ -1,16 +1,27 @@
-from rest_framework import generics, status, viewsets
+from rest_framework import generics, serializers, status, viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from .permissions import IsVerificated
+from .renderers import EventStreamRenderer, NDJSONRenderer
+from .grading import GradingError, find_grading_target, save_exam_result, save_exam_answers
+from .examStats import exam_statistics, paper_statistics
+from .examineeImport import import_examinees
+from .authentication import invalidate_user_cache
+from .leaderboard import rank, top, update_score, update_scores
+from .resultExport import export_rows
+from .spreadsheet import SpreadsheetError, stream_csv, write_xlsx
 from .models import *
 from .serializers import *
 from .tasks import *
 from app import randomX
 from datetime import datetime, timedelta
 import time
-from django.http import Http404, StreamingHttpResponse, HttpResponse
-from django.db import transaction
+import json
+import zipfile
+from django.http import FileResponse, Http404, StreamingHttpResponse, HttpResponse
+from django.db import IntegrityError, transaction
 from django.core.cache import cache
 
 class RegisterView(generics.CreateAPIView):
@@ -18,11 +29,19 @@ class RegisterView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserRegisterSerializer
 
+def save_unique(serializer, message, **kwargs):
+    # Serializer đã kiểm tra trùng, nhưng 2 request cùng lúc vẫn có thể cùng qua: khi đó ràng buộc unique của DB chặn lại
+    try:
+        with transaction.atomic():
+            return serializer.save(**kwargs)
+    except IntegrityError:
+        raise serializers.ValidationError({"detail": message})
+
 class ExamViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsVerificated]
     serializer_class = ExamSerializer
     def get_queryset(self):
-        queryset = Exam.objects.filter(user=self.request.user)
+        queryset = annotate_exam_counts(Exam.objects.filter(user=self.request.user))
         return queryset
 
     def perform_create(self, serializer):
@@ -41,6 +60,13 @@ class ExamPaperViewSet(viewsets.ModelViewSet):
             raise Http404("Exam not found")
         serializer.save(exam_id=exam_id)
 
+    def perform_update(self, serializer):
+        # Đổi số câu thì điểm thay đổi
+        number_of_questions = serializer.instance.number_of_questions
+        serializer.save()
+        if serializer.instance.number_of_questions != number_of_questions:
+            schedule_regrade(serializer.instance.id)
+
 class ExamAnswerViewSet(viewsets.ModelViewSet):
     serializer_class = ExamAnswerSerializer
     def get_queryset(self):
@@ -52,7 +78,16 @@ class ExamAnswerViewSet(viewsets.ModelViewSet):
         exam_paper = ExamPaper.objects.filter(pk=exam_paper_id).first()
         if not exam_paper:
             raise Http404("ExamPaper not found")
-        serializer.save(exam_paper_id=exam_paper_id)
+        save_unique(serializer, "Câu hỏi đã có đáp án", exam_paper_id=exam_paper_id)
+        schedule_regrade(exam_paper_id)
+
+    def perform_update(self, serializer):
+        save_unique(serializer, "Câu hỏi đã có đáp án")
+        schedule_regrade(serializer.instance.exam_paper_id)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        schedule_regrade(instance.exam_paper_id)
     
 class ExamineeViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsVerificated]
@@ -63,6 +98,24 @@ class ExamineeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+class ExamineeImportView(APIView):
+    permission_classes = [IsAuthenticated, IsVerificated]
+    def post(self, request):
+        serializer = ExamineeImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        exam = None
+        exam_id = serializer.validated_data.get('exam')
+        if exam_id is not None:
+            exam = Exam.objects.filter(pk=exam_id, user=request.user).first()
+            if not exam:
+                return Response({"detail": "Không tìm thấy kỳ thi"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = import_examinees(request.user, serializer.validated_data['file'], serializer.validated_data['mode'], exam)
+        except SpreadsheetError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_200_OK)
+
 class ExamineeRecordViewSet(viewsets.ModelViewSet):
     serializer_class = ExamineeRecordSerializer
     def get_queryset(self):
@@ -74,7 +127,14 @@ class ExamineeRecordViewSet(viewsets.ModelViewSet):
         exam = Exam.objects.filter(pk=exam_id).first()
         if not exam:
             raise Http404("Exam not found")
-        serializer.save(exam_id=exam_id)
+        record = save_unique(serializer, "Thí sinh đã có bản ghi trong kỳ thi này", exam_id=exam_id)
+        transaction.on_commit(lambda: update_score(record.exam_id, record.examinee_id, record.score))
+
+    def perform_update(self, serializer):
+        old_examinee_id = serializer.instance.examinee_id
+        record = save_unique(serializer, "Thí sinh đã có bản ghi trong kỳ thi này")
+        scores = {old_examinee_id: None, record.examinee_id: record.score}
+        transaction.on_commit(lambda: update_scores(record.exam_id, scores))
 
 class ExamineeRecordDetailView(APIView):
     serializer_class = ExamineeRecordDetailSerializer
@@ -95,27 +155,94 @@ class ExamPaperBatchAnswerView(APIView):
         
         serializer = ExamPaperBatchAnswerSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        answers = serializer.validated_data['answers']
+        counts = save_exam_answers(exam_paper, serializer.validated_data['answers'])
+        if counts["created"] or counts["updated"]:
+            schedule_regrade(exam_paper.id)
 
-        with transaction.atomic():
-            for ans in answers:
-                question_number = ans.get('question_number')
-                answer_number = ans.get('answer_number')
-                exam_answer = ExamAnswer.objects.filter(exam_paper=exam_paper, question_number=question_number).first()
-                if exam_answer:
-                    exam_answer.answer_number = answer_number
-                    exam_answer.save()
-                    continue
-                exam_answer = ExamAnswer(exam_paper=exam_paper, question_number=question_number, answer_number=answer_number)
-                exam_answer.save()
-
-        return Response({"detail": "Answers saved successfully"}, status=status.HTTP_201_CREATED)
+        return Response({"detail": "Answers saved successfully", **counts}, status=status.HTTP_201_CREATED)
 
 class ExamineeResultViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ExamineeResultSerializer
+    pagination_class = None # Chỉ có 1 bản ghi
     def get_queryset(self):
         examineeRecord = self.kwargs.get('examinee_record_pk')
-        return ExamineeRecord.objects.filter(pk=examineeRecord)
+        return annotate_result_paper(ExamineeRecord.objects.filter(pk=examineeRecord).select_related('exam_paper'))
+
+class ExamStatisticsView(APIView):
+    permission_classes = [IsAuthenticated, IsVerificated]
+    def get(self, request, exam_pk):
+        exam = Exam.objects.filter(pk=exam_pk, user=request.user).first()
+        if not exam:
+            raise Http404("Exam not found")
+        return Response(exam_statistics(exam), status=status.HTTP_200_OK)
+
+class ExamExportView(APIView):
+    permission_classes = [IsAuthenticated, IsVerificated]
+    def get(self, request, exam_pk):
+        # ?file_type=csv|xlsx (`format` đã được DRF dùng để chọn renderer)
+        exam = Exam.objects.filter(pk=exam_pk, user=request.user).first()
+        if not exam:
+            raise Http404("Exam not found")
+        file_type = request.query_params.get('file_type', 'csv')
+        if file_type not in ('csv', 'xlsx'):
+            return Response({"detail": "file_type phải là csv hoặc xlsx"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filename = f"exam_{exam.id}_results.{file_type}"
+        if file_type == 'xlsx':
+            try:
+                out = write_xlsx(export_rows(exam), title="Results")
+            except SpreadsheetError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return FileResponse(out, as_attachment=True, filename=filename, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+        response = StreamingHttpResponse(stream_csv(export_rows(exam)), content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+class ExamLeaderboardView(APIView):
+    permission_classes = [IsAuthenticated, IsVerificated]
+    def get(self, request, exam_pk):
+        # ?top=N (mặc định 10, tối đa 100)
+        exam = Exam.objects.filter(pk=exam_pk, user=request.user).first()
+        if not exam:
+            raise Http404("Exam not found")
+        try:
+            n = min(max(int(request.query_params.get('top', 10)), 1), 100)
+        except ValueError:
+            return Response({"detail": "top phải là số nguyên"}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries, total = top(exam.id, n)
+        examinees = Examinee.objects.in_bulk([examinee_id for examinee_id, _, _ in entries])
+        results = []
+        for examinee_id, score, rank in entries:
+            examinee = examinees.get(examinee_id)
+            results.append({
+                "rank": rank,
+                "examinee": examinee_id,
+                "student_ID": examinee.student_ID if examinee else None,
+                "name": examinee.name if examinee else None,
+                "score": score,
+            })
+        return Response({"exam": exam.id, "total": total, "results": results}, status=status.HTTP_200_OK)
+
+class ExamLeaderboardRankView(APIView):
+    permission_classes = [IsAuthenticated, IsVerificated]
+    def get(self, request, exam_pk, examinee_pk):
+        exam = Exam.objects.filter(pk=exam_pk, user=request.user).first()
+        if not exam:
+            raise Http404("Exam not found")
+        result = rank(exam.id, examinee_pk)
+        if result is None:
+            raise Http404("Thí sinh chưa có điểm trong kỳ thi này")
+        return Response({"exam": exam.id, "examinee": examinee_pk, **result}, status=status.HTTP_200_OK)
+
+class ExamPaperStatisticsView(APIView):
+    permission_classes = [IsAuthenticated, IsVerificated]
+    def get(self, request, exam_paper_pk):
+        exam_paper = ExamPaper.objects.filter(pk=exam_paper_pk, exam__user=request.user).first()
+        if not exam_paper:
+            raise Http404("ExamPaper not found")
+        return Response(paper_statistics(exam_paper), status=status.HTTP_200_OK)
 
 class SendOTPForVerifyView(APIView):
     permission_classes = [AllowAny]
@@ -193,6 +320,7 @@ class VerifyEmailView(APIView):
         user = CustomUser.objects.filter(username=action_request.user.username).first()
         user.isVerificated = True
         user.save()
+        invalidate_user_cache(user.id)
         action_request.delete()
         return Response({"detail": "Xác thực email thành công"}, status=status.HTTP_200_OK)
 
@@ -211,6 +339,7 @@ class ChangePasswordView(APIView):
         
         user.set_password(new_password)
         user.save()
+        invalidate_user_cache(user.id)
         return Response({"detail": "Đổi mật khẩu thành công"}, status=status.HTTP_200_OK)
 
 class PasswordResetView(APIView):   
@@ -229,6 +358,7 @@ class PasswordResetView(APIView):
         user = action_request.user
         user.set_password(new_password)
         user.save()
+        invalidate_user_cache(user.id)
         action_request.delete()
         return Response({"detail": "Đặt lại mật khẩu thành công"}, status=status.HTTP_200_OK)
 
@@ -276,22 +406,158 @@ class ImageProcessView(APIView):
         if not image:
             return Response({"detail": "Không tìm thấy hình ảnh để xử lý"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Lưu hình ảnh vào thư mục tạm thời
-        os.makedirs(s3Image.BASE_DIR / "temporary", exist_ok=True)
         file_name = randomX.randomFileName()
         ext = os.path.splitext(image.name)[1]
-        image.name = file_name + ext
-        local_image_path = s3Image.BASE_DIR / "temporary" / image.name
-        with open(local_image_path, "wb") as f:
-            f.write(image.read())  
         
-        # Xử lý hình ảnh
-        result = process_image(image.name)
+        # Xử lý hình ảnh trực tiếp trong bộ nhớ
+        result = process_image(image.read(), file_name + ext)
         if not result:
             return Response({"detail": "Xử lý hình ảnh thất bại"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         return Response(result, status=200)
     
+class ImageProcessJobView(APIView):
+    # Tạo job xử lý ảnh bất đồng bộ, trả về job_id ngay
+    def post(self, request):
+        imageProcessSerializer = ImageProcessSerializer(data=request.data)
+        imageProcessSerializer.is_valid(raise_exception=True)
+
+        image = imageProcessSerializer.validated_data.get('image', None)
+        if not image:
+            return Response({"detail": "Không tìm thấy hình ảnh để xử lý"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_name = randomX.randomFileName()
+        ext = os.path.splitext(image.name)[1]
+        job_id = submit_inference(image.read(), file_name + ext, request.user.id)
+        return Response(get_inference_job(job_id), status=status.HTTP_202_ACCEPTED)
+
+def get_user_job(request, job_id):
+    if get_job_owner(job_id) != request.user.id:
+        raise Http404("Job not found")
+    return get_inference_job(job_id)
+
+class ImageProcessJobDetailView(APIView):
+    # Polling trạng thái / kết quả của job
+    def get(self, request, job_id):
+        return Response(get_user_job(request, job_id), status=status.HTTP_200_OK)
+
+# Giây. Mỗi stream giữ 1 thread của uWSGI (uwsgi.ini: processes x threads) nên stream ngắn, client tự kết nối lại hoặc polling
+JOB_EVENTS_DURATION = 10
+JOB_EVENTS_RETRY = 2000 # ms, thời gian chờ trước khi client kết nối lại
+JOB_READY_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+class ImageProcessJobEventsView(APIView):
+    # Server-Sent Events: gửi trạng thái mỗi khi job thay đổi cho tới khi xong
+    renderer_classes = [EventStreamRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+
+    def event_generator(self, job, job_id):
+        deadline = time.time() + JOB_EVENTS_DURATION
+        yield f"retry: {JOB_EVENTS_RETRY}\n\n"
+        last = None
+        while True:
+            if job != last:
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+                last = job
+            if job["status"] in JOB_READY_STATES or time.time() > deadline:
+                return
+            time.sleep(0.5)
+            job = get_inference_job(job_id)
+
+    def get(self, request, job_id):
+        job = get_user_job(request, job_id)
+        response = StreamingHttpResponse(
+            self.event_generator(job, job_id),
+            content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+BATCH_MAX_IMAGES = 100
+BATCH_MAX_IMAGE_SIZE = 20 * 1024 * 1024
+BATCH_MAX_TOTAL_SIZE = 200 * 1024 * 1024
+BATCH_IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+class ImageProcessBatchView(APIView):
+    # Xử lý nhiều tờ bài (nhiều ảnh hoặc 1 file ZIP), trả kết quả từng tờ dạng NDJSON ngay khi xong
+    renderer_classes = [NDJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+
+    def read_sheets(self, images, archive):
+        # Trả về danh sách (tên, dữ liệu ảnh hoặc None, lỗi)
+        # Kiểm tra số ảnh và tổng dung lượng (theo header của ZIP) trước khi giải nén
+        entries = []
+        if archive:
+            try:
+                zf = zipfile.ZipFile(archive)
+            except zipfile.BadZipFile:
+                raise serializers.ValidationError({"archive": "File ZIP không hợp lệ"})
+            entries = [
+                info for info in zf.infolist()
+                if not info.is_dir() and not info.filename.startswith('__MACOSX/') and info.filename.lower().endswith(BATCH_IMAGE_EXTS)
+            ]
+        if len(images) + len(entries) > BATCH_MAX_IMAGES:
+            raise serializers.ValidationError({"detail": f"Tối đa {BATCH_MAX_IMAGES} ảnh mỗi lần"})
+        sizes = [image.size for image in images] + [info.file_size for info in entries]
+        if sum(size for size in sizes if size <= BATCH_MAX_IMAGE_SIZE) > BATCH_MAX_TOTAL_SIZE:
+            raise serializers.ValidationError({"detail": f"Tổng dung lượng ảnh tối đa {BATCH_MAX_TOTAL_SIZE // (1024 * 1024)}MB mỗi lần"})
+
+        sheets = []
+        for image in images:
+            if image.size > BATCH_MAX_IMAGE_SIZE:
+                sheets.append((image.name, None, "Ảnh quá lớn"))
+                continue
+            sheets.append((image.name, image.read(), None))
+        if archive:
+            with zf:
+                for info in entries:
+                    if info.file_size > BATCH_MAX_IMAGE_SIZE:
+                        sheets.append((info.filename, None, "Ảnh quá lớn"))
+                        continue
+                    try:
+                        # ZipExtFile chỉ đọc tối đa file_size byte
+                        sheets.append((info.filename, zf.read(info), None))
+                    except (zipfile.BadZipFile, NotImplementedError, RuntimeError):
+                        sheets.append((info.filename, None, "Không đọc được ảnh trong file ZIP"))
+        return sheets
+
+    def ready_lines(self, pending):
+        for index in list(pending):
+            name, job_id = pending[index]
+            job = get_inference_job(job_id)
+            if job["status"] in JOB_READY_STATES:
+                del pending[index]
+                yield json.dumps({"index": index, "name": name, **job}) + "\n"
+
+    def ndjson_generator(self, sheets, user_id):
+        # Mỗi tờ: 1 dòng `QUEUED` khi gửi đi (có job_id để tra cứu lại), 1 dòng kết quả khi xong
+        # Quá JOB_EVENTS_DURATION thì các tờ chưa xong nhận dòng `TIMEOUT`, client tra cứu tiếp theo job_id
+        deadline = time.time() + JOB_EVENTS_DURATION
+        pending = {}
+        for index, (name, data, error) in enumerate(sheets):
+            if data is None:
+                yield json.dumps({"index": index, "name": name, "status": "FAILURE", "detail": error}) + "\n"
+                continue
+            ext = os.path.splitext(name)[1]
+            job_id = submit_inference(data, randomX.randomFileName() + ext, user_id)
+            pending[index] = (name, job_id)
+            yield json.dumps({"index": index, "name": name, "job_id": job_id, "status": "QUEUED"}) + "\n"
+            yield from self.ready_lines(pending)
+        while pending and time.time() < deadline:
+            time.sleep(0.2)
+            yield from self.ready_lines(pending)
+        for index, (name, job_id) in pending.items():
+            yield json.dumps({"index": index, "name": name, "job_id": job_id, "status": "TIMEOUT", "detail": "Chưa xử lý xong, tra cứu lại theo job_id"}) + "\n"
+
+    def post(self, request):
+        serializer = ImageProcessBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sheets = self.read_sheets(serializer.validated_data.get('images', []), serializer.validated_data.get('archive', None))
+
+        response = StreamingHttpResponse(
+            self.ndjson_generator(sheets, request.user.id),
+            content_type="application/x-ndjson"
+        )
+        response["X-Accel-Buffering"] = "no"
+        return response
+
 class ImageProcessSaveView(APIView):
     def post(self, request):
         # Nhận result của ImageProcess (sau khi client xác nhận và chỉnh sửa nếu cần)
@@ -303,67 +569,94 @@ class ImageProcessSaveView(APIView):
             return Response({"detail": "Không tìm thấy kỳ thi"}, status=status.HTTP_400_BAD_REQUEST)
         
         result = serializer.validated_data.get('result', {})
+        examinee, examineeRecord, exam_paper = find_grading_target(request.user, exam, result)
+
+        # Tải ảnh trước và sau xử lý lên S3
+        original_image_key = None
+        before_image = result.get('original_image', None)
+        if before_image:
+            original_image = io.BytesIO(base64.b64decode(before_image))
+            original_image.name = result.get('original_image_name', 'original_image.jpg')
+            original_image_key = upload_image(original_image)
+
+        processed_image_key = None
+        processed_image = result.get('processed_image', None)
+        if processed_image:
+            processed_image = io.BytesIO(base64.b64decode(processed_image))
+            processed_image.name = result.get('processed_image_name', 'processed_image.jpg')
+            processed_image_key = upload_image(processed_image)
+
+        save_exam_result(examinee, examineeRecord, exam_paper, result.get('answers', {}), original_image_key, processed_image_key)
+
+        return Response({"detail": "Lưu kết quả bài thi thành công"}, status=status.HTTP_200_OK)
+
+def grade_scan(request, exam, scan_id, scan):
+    # Chấm và lưu bản scan đã lưu (ảnh đã ở trên S3), trả về dữ liệu cho client
+    result = scan["result"]
+    urls = get_image_urls([scan["original_image"], scan["processed_image"]])
+    data = {
+        "scan_id": scan_id,
+        "saved": False,
+        **result,
+        "original_image": urls.get(scan["original_image"]),
+        "processed_image": urls.get(scan["processed_image"]),
+    }
+    try:
+        examinee, examineeRecord, exam_paper = find_grading_target(request.user, exam, result)
+    except GradingError as e:
+        data["detail"] = e.detail
+        return data
+
+    correct_count, score = save_exam_result(examinee, examineeRecord, exam_paper, result.get('answers', {}), scan["original_image"], scan["processed_image"])
+    data.update({
+        "saved": True,
+        "detail": "Lưu kết quả bài thi thành công",
+        "examinee_record": examineeRecord.id,
+        "correct_answers": correct_count,
+        "score": score,
+    })
+    return data
+
+class ImageProcessGradeView(APIView):
+    # Xử lý ảnh, chấm theo đáp án và lưu kết quả ngay trên server (ảnh không quay về client)
+    def post(self, request):
+        serializer = ImageProcessGradeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        exam = Exam.objects.filter(pk=serializer.validated_data['exam'], user=request.user).first()
+        if not exam:
+            return Response({"detail": "Không tìm thấy kỳ thi"}, status=status.HTTP_400_BAD_REQUEST)
 
-        student_ID = result.get('sbd', None)
-        examinee = Examinee.objects.filter(user=request.user, student_ID=student_ID).first() if student_ID else None
-        if not examinee:
-            return Response({"detail": "Không tìm thấy thí sinh"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        print(exam, examinee)
-        examineeRecord = ExamineeRecord.objects.filter(exam=exam, examinee=examinee).first() if exam and examinee else None
-        if not examineeRecord:
-            return Response({"detail": "Không tìm thấy bản ghi thí sinh"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Lấy đề thi từ ExamPaper
-        exam_paper = ExamPaper.objects.filter(exam=exam, exam_paper_code=result.get('made', None)).first()
-        if not exam_paper:
-            return Response({"detail": "Không tìm thấy đề thi"}, status=status.HTTP_400_BAD_REQUEST)
+        image = serializer.validated_data['image']
+        data = image.read()
+        result = scan_image(data)
+        if not result:
+            return Response({"detail": "Xử lý hình ảnh thất bại"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        processed_image = base64.b64decode(result.pop('processed_image'))
+        result.pop('processed_image_name', None)
+
+        # Tải ảnh lên S3 trực tiếp từ bộ nhớ
+        original_file = io.BytesIO(data)
+        original_file.name = image.name
+        processed_file = io.BytesIO(processed_image)
+        processed_file.name = 'processed_image.jpg'
+        scan_id, scan = save_scan(request.user.id, result, upload_image(original_file), upload_image(processed_file))
+
+        return Response(grade_scan(request, exam, scan_id, scan), status=status.HTTP_200_OK)
+
+class ImageProcessCorrectView(APIView):
+    # Sửa kết quả (sbd, made, answers) của bản scan đã lưu theo scan_id rồi chấm lại, không cần gửi lại ảnh
+    def post(self, request, scan_id):
+        serializer = ImageProcessCorrectSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        scan = get_scan(scan_id)
+        if not scan or scan["user"] != request.user.id:
+            raise Http404("Scan not found")
+        exam = Exam.objects.filter(pk=serializer.validated_data['exam'], user=request.user).first()
+        if not exam:
+            return Response({"detail": "Không tìm thấy kỳ thi"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Lấy đáp án đúng từ ExamAnswer
-        correct_answers = ExamAnswer.objects.filter(exam_paper=exam_paper)
-        correct_answer_dict = {ans.question_number: ans.answer_number for ans in correct_answers}
+        correction = serializer.validated_data.get('result', {})
+        scan["result"].update({key: correction[key] for key in ('sbd', 'made', 'answers') if key in correction})
+        update_scan(scan_id, scan)
 
-        # Kiểm tra và lưu đáp án vào ExamineePaper
-        with transaction.atomic():
-            # Tải ảnh trước và sau xử lý lên S3
-            before_image = result.get('original_image', None)
-            if before_image:
-                original_image_data = base64.b64decode(before_image)
-                original_image = io.BytesIO(original_image_data)
-                original_image.name = result.get('original_image_name', 'original_image.jpg')
-                examineeRecord.original_image = upload_image(original_image)
-            
-            processed_image = result.get('processed_image', None)
-            if processed_image:
-                processed_image_data = base64.b64decode(processed_image)
-                processed_image = io.BytesIO(processed_image_data)
-                processed_image.name = result.get('processed_image_name', 'processed_image.jpg')
-                examineeRecord.processed_image = upload_image(processed_image)
-            
-            # Lưu đáp án và đếm số câu đúng
-            correct_count = 0
-            for q_num_str, ans_char in result.get('answers', {}).items():
-                question_number = int(q_num_str)
-                answer_number = ord(ans_char) - ord('A') if ans_char != '?' else 0
-                mark_result = False
-                if question_number in correct_answer_dict and answer_number == correct_answer_dict[question_number]:
-                    correct_count += 1
-                    mark_result = True
-                axaminee_answer = ExamineePaper.objects.filter(exam_paper=exam_paper, examinee=examinee, question_number=question_number).first()
-                if axaminee_answer:
-                    axaminee_answer.answer_number = answer_number
-                    axaminee_answer.mark_result = mark_result
-                    axaminee_answer.save()
-                    continue
-                examinee_answer = ExamineePaper(exam_paper=exam_paper, examinee=examinee, question_number=question_number, answer_number=answer_number, mark_result=mark_result)
-                examinee_answer.save()
-
-            # Tính điểm
-            score = (correct_count / exam_paper.number_of_questions) * 10 if exam_paper.number_of_questions > 0 else 0
-            
-            # Cập nhật ExamineeRecord
-            if examineeRecord:
-                examineeRecord.score = score
-                examineeRecord.save()
-
-        return Response({"detail": "Lưu kết quả bài thi thành công"}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(grade_scan(request, exam, scan_id, scan), status=status.HTTP_200_OK)
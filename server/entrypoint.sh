@@ -2,6 +2,15 @@
 set -e
 cd /app/server
 
+# Inference worker: mỗi process giữ 1 bản model, số process bằng số core, torch 1 thread/process
+start_inference_worker() {
+  echo "Starting Celery inference worker"
+  export INFERENCE_WORKER=true
+  export OMP_NUM_THREADS="${INFERENCE_TORCH_THREADS:-1}"
+  exec celery -A root worker --loglevel=INFO --pool=prefork \
+    --concurrency="${INFERENCE_CONCURRENCY:-$(nproc)}" -Q inference -n inference@%h
+}
+
 if [ "$PROD" = "true" ]; then
   if [ "$RUN_APP" = "true" ]; then
     echo "Starting uWSGI application server"
@@ -9,9 +18,11 @@ if [ "$PROD" = "true" ]; then
     exec uwsgi --ini ./uwsgi.ini
   elif [ "$RUN_CELERY" = "true" ]; then
     echo "Starting Celery worker"
-    exec celery -A root worker --loglevel=INFO --pool=threads
+    exec celery -A root worker --loglevel=INFO --pool=threads -Q celery
+  elif [ "$RUN_INFERENCE" = "true" ]; then
+    start_inference_worker
   else
-    echo "No valid RUN_APP or RUN_CELERY flag set. Exiting."
+    echo "No valid RUN_APP, RUN_CELERY or RUN_INFERENCE flag set. Exiting."
     exit 1
   fi
 else
@@ -22,9 +33,11 @@ else
     exec uwsgi --ini ./uwsgi.ini
   elif [ "$@" = "RUN_CELERY" ]; then
     echo "Starting Celery worker"
-    exec celery -A root worker --loglevel=INFO --pool=threads
+    exec celery -A root worker --loglevel=INFO --pool=threads -Q celery
+  elif [ "$@" = "RUN_INFERENCE" ]; then
+    start_inference_worker
   else
-    echo "No valid RUN_APP or RUN_CELERY flag set. Exiting."
+    echo "No valid RUN_APP, RUN_CELERY or RUN_INFERENCE flag set. Exiting."
     exit 1
   fi
 fi
@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'root.settings')
@@ -19,4 +20,32 @@ app.autodiscover_tasks()
 
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+
+def is_enabled(name):
+    return os.environ.get(name, 'False').lower() in ('1', 'true', 'yes')
+
+
+@worker_init.connect
+def warm_up_ai(**kwargs):
+    # Tải trước model AI khi worker khởi động (AI_WARMUP=True), mặc định tải ở lần dùng đầu tiên
+    # Inference worker tự tải model trong từng process con (xem init_inference_process)
+    if is_enabled('AI_WARMUP') and not is_enabled('INFERENCE_WORKER'):
+        from AI.ai import warm_up
+        warm_up()
+
+
+@worker_process_init.connect
+def init_inference_process(**kwargs):
+    # Mỗi process của inference worker: giới hạn số thread của torch/OpenCV và tải model 1 lần
+    if not is_enabled('INFERENCE_WORKER'):
+        return
+    import cv2
+    import torch
+    threads = int(os.environ.get('INFERENCE_TORCH_THREADS', '1'))
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+    from AI.ai import warm_up
+    warm_up()
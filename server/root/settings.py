@@ -143,11 +143,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'app.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
 signing_key_file = open(BASE_DIR / "certs/pkcs8.key")
@@ -179,21 +181,39 @@ PASSWORD_HASHERS = [
 
 AUTH_USER_MODEL = "app.CustomUser"
 
+REDIS_URL = f"redis://default:{env('REDIS_PASSWORD')}@{env('REDIS_HOST')}:{env('REDIS_PORT')}"
+
 # Celery
 CELERY_BROKER_URL = env('CLOUDAMQP_URL')
 CELERY_BROKER_POOL_LIMIT = 1
 CELERY_BROKER_HEARTBEAT = None
 CELERY_BROKER_CONNECTION_TIMEOUT = 30
-CELERY_RESULT_BACKEND = None
+CELERY_RESULT_BACKEND = REDIS_URL
+CELERY_RESULT_EXPIRES = timedelta(hours=1)
+CELERY_TASK_TRACK_STARTED = True
 CELERY_EVENT_QUEUE_EXPIRES = 60
 CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 CELERY_WORKER_CONCURRENCY = 50
+# Inference chạy trên queue riêng (worker prefork, xem entrypoint.sh RUN_INFERENCE)
+CELERY_TASK_ROUTES = {
+    'app.tasks.run_inference': {'queue': 'inference'},
+}
+
+# AI inference: local (chạy trong process hiện tại) hoặc queue (gửi sang inference worker)
+INFERENCE_MODE = env('INFERENCE_MODE', default='local')
+INFERENCE_TIMEOUT = env.int('INFERENCE_TIMEOUT', default=50) # Nhỏ hơn harakiri của uWSGI
+
+# Thời hạn URL ảnh đã ký (giây), URL được cache lại trong nửa đầu thời hạn
+IMAGE_URL_EXPIRES = env.int('IMAGE_URL_EXPIRES', default=3600)
+
+# Ngoài bài làm lưu gọn trên ExamineeRecord, có ghi thêm từng câu vào ExamineePaper hay không
+STORE_EXAMINEE_PAPER_ROWS = env.bool('STORE_EXAMINEE_PAPER_ROWS', default=True)
 
 # Cache backed
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": f"redis://default:{env('REDIS_PASSWORD')}@{env('REDIS_HOST')}:{env('REDIS_PORT')}",
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }